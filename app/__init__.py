@@ -3,11 +3,11 @@ from flask import Flask, redirect, url_for
 from flask_login import LoginManager
 from flask_session import Session
 from flask_wtf.csrf import CSRFProtect
-from redis import Redis
 
-from app.extensions import db, mail, cache
+from app.extensions import db, mail, cache, redis_client
 from app.models import User
 from app.routes import main_bp, auth, books_bp
+from app.commands import register_commands
 from config import Config
 
 login_manager = LoginManager()
@@ -23,11 +23,7 @@ def create_app():
     app.config["SESSION_PERMANENT"] = False
     app.config["SESSION_USE_SIGNER"] = True
     app.config["SESSION_KEY_PREFIX"] = "smartstack:"
-    app.config["SESSION_REDIS"] = Redis(
-        host=Config.REDIS_HOST,
-        port=Config.REDIS_PORT,
-        password=Config.REDIS_PASSWORD if Config.REDIS_PASSWORD else None
-    )
+    app.config["SESSION_REDIS"] = redis_client
     Session(app)
 
     app.config["CACHE_TYPE"] = Config.CACHE_TYPE
@@ -58,6 +54,8 @@ def create_app():
     app.register_blueprint(auth)
     app.register_blueprint(books_bp)
 
+    register_commands(app)
+
     app.logger.setLevel("INFO")
 
     return app
@@ -0,0 +1,175 @@
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+from app.extensions import db
+from app.models import Book, CandidateVolume
+from app.utils.recommend_engine import book_document
+from app.utils.tfidf_model import fit_vectorizer, save_vectorizer, get_shared_vectorizer
+from app.utils.jobs import run_worker, enqueue
+from app.utils.cooccurrence import build_item_neighbors
+from app.utils.harvester import harvest_catalog, vectorize_candidates
+from app.utils.volume_store import load_volumes, refresh_volumes, warm_volume_cache
+from app.utils.book_index import backfill_book_metadata
+from app.utils.google_books import stats as google_books_stats
+
+tfidf_cli = AppGroup("tfidf", help="Modelo TF-IDF compartido para recomendaciones.")
+jobs_cli = AppGroup("jobs", help="Cola de trabajos en segundo plano.")
+recommend_cli = AppGroup("recommend", help="Trabajos offline del recomendador.")
+catalog_cli = AppGroup("catalog", help="Catálogo local de candidatos para recomendaciones.")
+volumes_cli = AppGroup("volumes", help="Almacén persistente de volúmenes de Google Books.")
+search_cli = AppGroup("search", help="Búsqueda local sobre el catálogo de libros.")
+books_cli = AppGroup("books", help="Tablas normalizadas de autores y categorías.")
+gbooks_cli = AppGroup("gbooks", help="Uso de la API de Google Books.")
+
+
+def iter_book_documents(batch_size=1000):
+    query = Book.query.filter(Book.authors.isnot(None)).order_by(Book.id)
+    for b in query.yield_per(batch_size):
+        yield book_document(b)
+    candidates = CandidateVolume.query.with_entities(CandidateVolume.document)
+    for (document,) in candidates.yield_per(batch_size):
+        yield document
+
+
+@tfidf_cli.command("fit")
+def tfidf_fit():
+    """Fit the corpus-wide vectorizer and publish it as the current artifact."""
+    documents = list(iter_book_documents())
+    if not documents:
+        raise click.ClickException("No hay libros en la base de datos para entrenar el modelo.")
+
+    vectorizer = fit_vectorizer(documents)
+    version, path = save_vectorizer(vectorizer)
+    current_app.logger.info(f"[TFIDF] Modelo {version} entrenado con {len(documents)} documentos.")
+    click.echo(f"Modelo {version}: {len(documents)} documentos, {len(vectorizer.vocabulary_)} términos → {path}")
+    click.echo(f"{vectorize_candidates()} candidatos proyectados al nuevo modelo")
+
+
+@tfidf_cli.command("info")
+def tfidf_info():
+    """Show the artifact currently served to workers."""
+    vectorizer, version = get_shared_vectorizer()
+    if vectorizer is None:
+        click.echo("Sin modelo entrenado; los perfiles se ajustan por petición.")
+        return
+    click.echo(f"Modelo {version}: {len(vectorizer.vocabulary_)} términos")
+
+
+@jobs_cli.command("worker")
+@click.option("--poll-timeout", default=5, show_default=True, help="Segundos de espera por trabajo antes de volver a sondear.")
+def jobs_worker(poll_timeout):
+    """Run the background job worker until SIGTERM."""
+    run_worker(poll_timeout=poll_timeout)
+
+
+@jobs_cli.command("enqueue")
+@click.argument("name")
+@click.option("--user-id", type=int, default=None)
+def jobs_enqueue(name, user_id):
+    """Enqueue a job by name (e.g. recommendations.precompute --user-id 1)."""
+    kwargs = {"user_id": user_id} if user_id is not None else {}
+    enqueue(name, **kwargs)
+    click.echo(f"{name} encolado {kwargs or ''}")
+
+
+@recommend_cli.command("neighbors")
+@click.option("--top-k", default=20, show_default=True)
+@click.option("--min-score", default=0.05, show_default=True)
+def recommend_neighbors(top_k, min_score):
+    """Rebuild the item-to-item co-occurrence neighbors table."""
+    total = build_item_neighbors(top_k=top_k, min_score=min_score)
+    click.echo(f"{total} vecinos guardados")
+
+
+@catalog_cli.command("harvest")
+@click.option("--pages", type=int, default=None, help="Páginas por tema en esta ejecución.")
+def catalog_harvest(pages):
+    """Harvest recommendation candidates for every subject and language."""
+    click.echo(f"{harvest_catalog(pages_per_subject=pages)} candidatos guardados")
+
+
+@catalog_cli.command("vectorize")
+def catalog_vectorize():
+    """Project candidates missing a vector for the current model."""
+    click.echo(f"{vectorize_candidates()} candidatos vectorizados")
+
+
+@volumes_cli.command("load")
+@click.argument("path", type=click.File("r", encoding="utf-8"))
+def volumes_load(path):
+    """Load volumes from a JSON-lines dump of Google Books API items or responses."""
+    click.echo(f"{load_volumes(path)} volúmenes guardados")
+
+
+@volumes_cli.command("warm")
+@click.option("--limit", type=int, default=None, help="Máximo de volúmenes a copiar (los más recientes primero).")
+def volumes_warm(limit):
+    """Copy stored volumes into the Redis detail cache."""
+    click.echo(f"{warm_volume_cache(limit=limit)} volúmenes copiados a la caché")
+
+
+@volumes_cli.command("refresh")
+@click.option("--limit", default=200, show_default=True)
+def volumes_refresh(limit):
+    """Re-fetch the stored volumes that are past their refresh date."""
+    click.echo(f"{refresh_volumes(limit=limit)} volúmenes refrescados")
+
+
+@search_cli.command("index")
+def search_index():
+    """Create the FULLTEXT index used by local search on an existing database."""
+    for index in Book.__table__.indexes:
+        if index.name == "ft_books_search":
+            index.create(bind=db.engine, checkfirst=True)
+    click.echo("Índice de búsqueda listo")
+
+
+@books_cli.command("index")
+def books_index():
+    """Backfill the authors/categories tables for every book."""
+    click.echo(f"{backfill_book_metadata()} libros indexados")
+
+
+@gbooks_cli.command("stats")
+@click.option("--days", default=1, show_default=True, help="Días (UTC) a mostrar, empezando por hoy.")
+def gbooks_stats(days):
+    """Show Google Books calls, errors and latency per endpoint and day."""
+    today = datetime.utcnow()
+    for offset in range(days):
+        day = today - timedelta(days=offset)
+        click.echo(f"{day:%Y-%m-%d}")
+        entries = google_books_stats(day)
+        if not entries:
+            click.echo("  sin llamadas")
+        for endpoint, entry in sorted(entries.items()):
+            statuses = ", ".join(f"{status}={count}" for status, count in sorted(entry["statuses"].items()))
+            click.echo(
+                f"  {endpoint:8} {entry['calls']:6} llamadas  {entry['errors']:5} errores  "
+                f"{entry['avg_ms']:7.0f} ms de media  ({statuses})"
+            )
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db():
+    """Create any missing tables, and indexes added to existing tables since."""
+    db.create_all()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    click.echo("Tablas creadas")
+
+
+def register_commands(app):
+    app.cli.add_command(tfidf_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(recommend_cli)
+    app.cli.add_command(catalog_cli)
+    app.cli.add_command(volumes_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(books_cli)
+    app.cli.add_command(gbooks_cli)
+    app.cli.add_command(init_db)
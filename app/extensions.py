@@ -2,8 +2,17 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_mail import Mail
 from flask_caching import Cache
+from redis import Redis
+from config import Config
 mail = Mail()
 
 db = SQLAlchemy()
 login_manager = LoginManager()
-cache = Cache()
\ No newline at end of file
+cache = Cache()
+
+# Connections are opened lazily, so each gunicorn worker gets its own pool after fork.
+redis_client = Redis(
+    host=Config.REDIS_HOST,
+    port=Config.REDIS_PORT,
+    password=Config.REDIS_PASSWORD if Config.REDIS_PASSWORD else None
+)
@@ -1 +1,5 @@
-from .models import User, Book, Wishlist, UserLibrary, WishlistBook, LibraryBook
\ No newline at end of file
+from .models import (
+    User, Book, Wishlist, UserLibrary, WishlistBook, LibraryBook, BookNeighbor,
+    CandidateVolume, CandidateCategory, HarvestState, StoredVolume,
+    IsbnLookup, Author, BookAuthor, Category, BookCategory,
+)
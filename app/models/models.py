@@ -13,6 +13,8 @@ class WishlistBook(db.Model):
     wishlist = db.relationship('Wishlist', back_populates='wishlist_books')
     book = db.relationship('Book')
 
+    __table_args__ = (db.Index('ix_wishlist_books_wishlist_added', 'wishlist_id', 'added_at'),)
+
 
 # Library association model with timestamp
 class LibraryBook(db.Model):
@@ -24,6 +26,8 @@ class LibraryBook(db.Model):
     library = db.relationship('UserLibrary', back_populates='library_books')
     book = db.relationship('Book')
 
+    __table_args__ = (db.Index('ix_library_books_library_added', 'library_id', 'added_at'),)
+
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -60,7 +64,8 @@ class Book(db.Model):
     authors = db.Column(db.String(255))
     categories = db.Column(db.Text)
     language = db.Column(db.String(50))
-    isbn = db.Column(db.String(20), nullable=True)
+    # Indexed for the ISBN resolver's first tier (isbn IN (...)).
+    isbn = db.Column(db.String(20), nullable=True, index=True)
     thumbnail = db.Column(db.String(512))
     small_thumbnail = db.Column(db.String(512))
     description = db.Column(db.Text)
@@ -69,28 +74,148 @@ class Book(db.Model):
 
     wishlists = db.relationship('WishlistBook', back_populates='book', cascade="all, delete-orphan")
     library_books = db.relationship('LibraryBook', back_populates='book', cascade="all, delete-orphan")
+    # Rows of the normalized author and category tables; lists of books should
+    # selectinload them so the properties below don't query once per book.
+    indexed_authors = db.relationship('Author', secondary='book_authors', order_by='Author.id', viewonly=True)
+    indexed_categories = db.relationship('Category', secondary='book_categories', order_by='Category.id', viewonly=True)
+
+    # Local search tier; InnoDB keeps FULLTEXT indexes current on every insert.
+    __table_args__ = (
+        db.Index('ft_books_search', 'title', 'authors', 'publisher', 'categories', mysql_prefix='FULLTEXT'),
+    )
 
     def __repr__(self):
         return f"<Book {self.title}>"
 
+    # The lists come from the normalized tables; a book the backfill hasn't
+    # indexed yet falls back to splitting its stored strings.
     @property
     def authors_list(self):
+        if self.indexed_authors:
+            return [a.name for a in self.indexed_authors]
         if not self.authors:
             return []
         return [a.strip() for a in self.authors.split(",")]
 
     @property
     def categories_list(self):
+        if self.indexed_categories:
+            return [c.name for c in self.indexed_categories]
         if not self.categories:
             return []
         return [c.strip() for c in self.categories.split(",")]
 
     @property
     def categories_flat(self):
-        if not self.categories:
-            return []
-        raw = self.categories.split(",") if isinstance(self.categories, str) else self.categories
-        return [part.strip() for cat in raw for part in cat.split("/") if part.strip()]
+        return [part.strip() for cat in self.categories_list for part in cat.split("/") if part.strip()]
+
+
+# Normalized authors and categories, filled when books are written (and by the
+# `flask books index` backfill). name_key is the lookup form of the name:
+# lowercased and accent-free, so it can't collide under MySQL's
+# accent-insensitive collation.
+class Author(db.Model):
+    __tablename__ = 'authors'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    name_key = db.Column(db.String(255), unique=True, nullable=False)
+
+
+class BookAuthor(db.Model):
+    __tablename__ = 'book_authors'
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('authors.id', ondelete='CASCADE'), primary_key=True, index=True)
+
+
+class Category(db.Model):
+    __tablename__ = 'categories'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    name_key = db.Column(db.String(255), unique=True, nullable=False)
+    # CATEGORY_GROUPS group the raw category maps to ("Other" when none does)
+    main_category = db.Column(db.String(100), nullable=False, index=True)
+
+
+class BookCategory(db.Model):
+    __tablename__ = 'book_categories'
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True, index=True)
+
+
+# Precomputed "readers also shelved" neighbors, rebuilt by the co-occurrence job
+class BookNeighbor(db.Model):
+    __tablename__ = 'book_neighbors'
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    neighbor_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+    neighbor = db.relationship('Book', foreign_keys=[neighbor_id])
+
+
+# Local pool of recommendation candidates, filled ahead of time by the harvester
+class CandidateVolume(db.Model):
+    __tablename__ = 'candidate_volumes'
+
+    google_id = db.Column(db.String(50), primary_key=True)
+    language = db.Column(db.String(20), nullable=False)
+    title = db.Column(db.String(255), nullable=False)
+    authors = db.Column(db.JSON, nullable=False)
+    categories = db.Column(db.JSON)
+    publisher = db.Column(db.String(255))
+    published_date = db.Column(db.String(20))
+    thumbnail = db.Column(db.String(512))
+    isbn = db.Column(db.String(20))
+    description = db.Column(db.Text)
+    dedupe_key = db.Column(db.String(255), nullable=False)
+    document = db.Column(db.Text, nullable=False)
+    vector = db.Column(db.LargeBinary)
+    model_version = db.Column(db.String(20), index=True)
+    # rank_local_candidates reads the pool newest first on every request.
+    harvested_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    main_categories = db.relationship('CandidateCategory', back_populates='candidate', cascade="all, delete-orphan")
+
+
+class CandidateCategory(db.Model):
+    __tablename__ = 'candidate_categories'
+    main_category = db.Column(db.String(100), primary_key=True)
+    google_id = db.Column(db.String(50), db.ForeignKey('candidate_volumes.google_id', ondelete='CASCADE'), primary_key=True)
+
+    candidate = db.relationship('CandidateVolume', back_populates='main_categories')
+
+
+class HarvestState(db.Model):
+    __tablename__ = 'harvest_state'
+    language = db.Column(db.String(20), primary_key=True)
+    subject = db.Column(db.String(100), primary_key=True)
+    next_index = db.Column(db.Integer, nullable=False, default=0)
+    exhausted = db.Column(db.Boolean, nullable=False, default=False)
+    last_run_at = db.Column(db.DateTime)
+
+
+# Durable copy of every Google Books volume we have fetched (L2 behind Redis).
+# found=False records a volume the API returned no data for.
+class StoredVolume(db.Model):
+    __tablename__ = 'volumes'
+
+    google_id = db.Column(db.String(50), primary_key=True)
+    isbn = db.Column(db.String(20), index=True)
+    language = db.Column(db.String(20))
+    title = db.Column(db.String(255))
+    payload = db.Column(db.JSON, nullable=False)
+    found = db.Column(db.Boolean, nullable=False, default=True)
+    fetched_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    refresh_after = db.Column(db.DateTime, nullable=False, index=True)
+
+
+# ISBN -> google_id answers learned from the API; google_id is NULL when the
+# API had no match (a negative entry, trusted for ISBN_NEGATIVE_TTL only).
+class IsbnLookup(db.Model):
+    __tablename__ = 'isbn_lookups'
+
+    isbn = db.Column(db.String(13), primary_key=True)
+    google_id = db.Column(db.String(50))
+    checked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
 
 class Wishlist(db.Model):
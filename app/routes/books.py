@@ -10,12 +10,10 @@ from flask import (
     session,
     current_app,
 )
-import requests
 from flask_login import login_required, current_user
 from app.models import Book, Wishlist, UserLibrary, User, WishlistBook, LibraryBook
-from app.extensions import db, cache
+from app.extensions import db
 from app.utils.books import get_or_create_book, clean_description
-import math
 import hashlib
 from datetime import datetime, timedelta
 
@@ -23,11 +21,45 @@ import re
 from sqlalchemy.orm import joinedload
 
 from app.utils.recommend_engine import (
-    build_user_profile,
-    fetch_google_books,
-    group_books_by_category,
+    get_user_profile,
+    record_library_change,
+    rank_recommendations,
+    get_user_library_books,
+    profile_key,
+    read_library_version,
+    next_recommendation_page,
+    store_recommendations,
     CATEGORY_GROUPS,
 )
+from app.utils.jobs import enqueue
+from app.utils.tfidf_model import get_shared_vectorizer
+from app.utils.book_index import user_main_categories
+from app.utils.swr_cache import swr_get
+from app.utils.volume_store import detail_cache_key, get_stored_volume
+from app.utils.isbn import google_id_for_isbn
+from app.utils.library_import import import_progress, start_import
+from app.utils.shelves import (
+    SHELF_PAGE_SIZE,
+    add_to_shelf,
+    remove_from_shelf,
+    shelf_membership,
+    shelf_page,
+)
+from app.utils.typeahead import suggest
+from app.utils.search import (
+    SEARCH_PAGE_SIZE,
+    build_query,
+    canonical_languages,
+    local_search,
+    prefetch_window,
+    search_results,
+    total_pages,
+)
+from app.utils.google_books import (
+    GoogleBooksError,
+    GoogleBooksHTTPError,
+    Volume,
+)
 import numpy as np
 
 books_bp = Blueprint("books", __name__)
@@ -45,13 +77,9 @@ def search_books():
     import re
 
     def get_book_id_by_isbn(isbn):
-        api_key = current_app.config["GOOGLE_BOOKS_API_KEY"]
-        params = {"q": f"isbn:{isbn}", "maxResults": 1, "key": api_key}
         try:
-            response = requests.get("https://www.googleapis.com/books/v1/volumes", params=params, timeout=5)
-            items = response.json().get("items", []) if response.status_code == 200 else []
-            return items[0]["id"] if items else None
-        except requests.RequestException:
+            return google_id_for_isbn(isbn)
+        except GoogleBooksError:
             return None
 
     query = request.args.get("q", "").strip()
@@ -59,11 +87,9 @@ def search_books():
     author_filter = request.args.get("author", "").strip()
     publisher_filter = request.args.get("publisher", "").strip()
     order_by = request.args.get("order", "relevance")
-    page = int(request.args.get("page", 1))
+    page = max(1, request.args.get("page", 1, type=int))
 
-    RESULTS_PER_PAGE = 10
-    MAX_RESULTS = 40
-    start_index = (page - 1) * RESULTS_PER_PAGE
+    RESULTS_PER_PAGE = SEARCH_PAGE_SIZE
 
     if not query and not author_filter and not publisher_filter:
         flash("Ingresa una palabra clave, autor o editorial para buscar libros.", "warning")
@@ -77,82 +103,39 @@ def search_books():
             flash(f"No se encontró ningún libro con ISBN {query}.", "warning")
             return render_template("books/search.html", results=[], page=page, total_pages=0)
 
-    q_parts = []
-    if query:
-        q_parts.append(query)
-    if author_filter:
-        q_parts.append(f"inauthor:{author_filter}")
-    if publisher_filter:
-        q_parts.append(f"inpublisher:{publisher_filter}")
-    q = " ".join(q_parts)
-
-    lang_restrict = lang_filters[0] if len(lang_filters) == 1 else None
-    cache_key = f"books:{q}|{order_by}|{','.join(lang_filters)}|page:{page}"
-
-    cached_results = cache.get(cache_key)
-    if cached_results:
-        current_app.logger.info(f"[CACHE HIT] Página {page} recuperada de caché para: {cache_key}")
-        filtered = cached_results
-    else:
-        api_key = current_app.config["GOOGLE_BOOKS_API_KEY"]
-        params = {
-            "q": q,
-            "maxResults": RESULTS_PER_PAGE,
-            "startIndex": start_index,
-            "orderBy": order_by,
-            "key": api_key,
-        }
-        if lang_restrict:
-            params["langRestrict"] = lang_restrict
+    q = build_query(query, author_filter, publisher_filter)
+    langs = canonical_languages(lang_filters)
+    offset = (page - 1) * RESULTS_PER_PAGE
 
-        try:
-            response = requests.get("https://www.googleapis.com/books/v1/volumes", params=params, timeout=5)
-            raw_results = response.json().get("items", []) if response.status_code == 200 else []
-        except requests.RequestException:
-            flash("Error de conexión con Google Books API.", "error")
-            return render_template("books/search.html", results=[], page=page, total_pages=0)
+    # Our own catalog answers first. When its hits fill the requested page the
+    # API is not asked at all; otherwise they lead the merged results and the
+    # API windows fill the rest. Each language's 40-result window is cached
+    # once (stale windows included, refreshed in the background); only a cold
+    # miss waits on the API.
+    local = local_search(query, author_filter, publisher_filter, langs)
+    try:
+        data = search_results(q, order_by, langs, local, offset + RESULTS_PER_PAGE)
+    except GoogleBooksError:
+        flash("Error de conexión con Google Books API.", "error")
+        return render_template("books/search.html", results=[], page=page, total_pages=0)
+
+    results = data["items"][offset:offset + RESULTS_PER_PAGE]
+    total_items = len(data["items"])
+    # Users paging past the first window, or reaching the last loaded page,
+    # are likely to keep going: fetch the next window before they ask for it.
+    if data["more"] and (data["windows"] > 1 or offset + 2 * RESULTS_PER_PAGE > total_items):
+        prefetch_window(q, order_by, langs, data["windows"])
+    pages = total_pages(total_items, data["more"], langs)
 
-        filtered = []
-        for item in raw_results:
-            volume = item.get("volumeInfo", {})
-            if not volume.get("title") or not volume.get("authors"):
-                continue
-            lang = volume.get("language", "")
-            if lang not in lang_filters:
-                continue
-            filtered.append({
-                "google_id": item["id"],
-                "title": volume.get("title"),
-                "authors": volume.get("authors", []),
-                "language": lang,
-                "thumbnail": volume.get("imageLinks", {}).get("thumbnail"),
-                "description": clean_description(volume.get("description", "")),
-                "publisher": volume.get("publisher", "").strip(),
-                "publishedDate": volume.get("publishedDate"),
-                "categories": volume.get("categories", []),
-                "isbn": next(
-                    (
-                        i["identifier"].replace("-", "").strip()
-                        for i in volume.get("industryIdentifiers", [])
-                        if i["type"] in ("ISBN_13", "ISBN_10")
-                    ),
-                    None,
-                ),
-            })
-        cache.set(cache_key, filtered)
-
-    total_items = len(filtered)
-    total_pages = min(4, math.ceil(MAX_RESULTS / RESULTS_PER_PAGE))
-    results = filtered
-
-    wishlist_ids = [book.google_id for book in getattr(current_user.wishlist, "books", [])]
-    library_ids = [book.google_id for book in getattr(current_user.library, "books", [])]
+    membership = shelf_membership(current_user.id)
+    wishlist_ids = membership["wishlist"]
+    library_ids = membership["library"]
 
     return render_template(
         "books/search.html",
         results=results,
         page=page,
-        total_pages=total_pages,
+        total_pages=pages,
         query=query,
         lang_filters=lang_filters,
         author=author_filter,
@@ -165,6 +148,13 @@ def search_books():
     )
 
 
+@books_bp.route("/search/suggest")
+@login_required
+def search_suggest():
+    # Answered from the worker's in-memory prefix index; never touches the API.
+    return {"suggestions": suggest(request.args.get("q", ""))}
+
+
 @books_bp.route("/toggle_library", methods=["POST"])
 @login_required
 def toggle_library():
@@ -201,7 +191,9 @@ def toggle_library():
     if link:
         db.session.delete(link)
         flash(f'📚 "{title}" fue eliminado de tu biblioteca.', "info")
+        library_delta = -1
     else:
+        library_delta = 1
         db.session.add(LibraryBook(library_id=library.id, book_id=book.id))
         flash(f'"{title}" fue añadido a tu biblioteca.', "success")
 
@@ -213,6 +205,13 @@ def toggle_library():
                 flash(f'📚 "{title}" fue movido de tu wishlist a la biblioteca.', "success")
 
     db.session.commit()
+    if library_delta > 0:
+        add_to_shelf(current_user.id, "library", book.google_id)
+        remove_from_shelf(current_user.id, "wishlist", book.google_id)
+    else:
+        remove_from_shelf(current_user.id, "library", book.google_id)
+    record_library_change(current_user.id, book, library_delta)
+    enqueue("recommendations.precompute", user_id=current_user.id)
     return redirect(request.referrer or url_for("books.search_books"))
 
 @books_bp.route("/toggle_wishlist", methods=["POST"])
@@ -241,7 +240,7 @@ def toggle_wishlist():
         return redirect(request.referrer or url_for("books.search_books"))
 
     #If the book is already on library, we don't let it be added to wishlist.
-    if current_user.library and any(b.id == book.id for b in current_user.library.books):
+    if current_user.library and LibraryBook.query.filter_by(library_id=current_user.library.id, book_id=book.id).first():
         flash(f'📚 "{title}" ya está en tu biblioteca. No se puede agregar a la wishlist.', "info")
         return redirect(request.referrer or url_for("books.search_books"))
 
@@ -262,6 +261,10 @@ def toggle_wishlist():
         flash(f'"{title}" fue añadido a tu wishlist.', "success")
 
     db.session.commit()
+    if wb:
+        remove_from_shelf(current_user.id, "wishlist", book.google_id)
+    else:
+        add_to_shelf(current_user.id, "wishlist", book.google_id)
     return redirect(request.referrer or url_for("books.search_books"))
 
 
@@ -271,48 +274,15 @@ def view_wishlist():
     page = request.args.get("page", 1, type=int)
     sort = request.args.get("sort", "recent")
     search = request.args.get("search", "", type=str).strip().lower()
-    per_page = 12
+    per_page = SHELF_PAGE_SIZE
 
     wishlist = current_user.wishlist
-    if not wishlist or not wishlist.wishlist_books:
-        return render_template(
-            "books/wishlist.html",
-            books=[],
-            page=1,
-            total=0,
-            per_page=per_page,
-            search=search,
-            sort=sort,
-            is_empty=True,
-        )
-
-    query = wishlist.wishlist_books
-
-    if search:
-        query = [
-            wb for wb in query
-            if search in (wb.book.title or "").lower()
-            or search in (wb.book.authors or "").lower()
-        ]
-
-    if sort == "title_asc":
-        query = sorted(query, key=lambda wb: (wb.book.title or "").lower())
-    elif sort == "title_desc":
-        query = sorted(query, key=lambda wb: (wb.book.title or "").lower(), reverse=True)
-    elif sort == "oldest":
-        query = sorted(query, key=lambda wb: wb.added_at)
-    else:
-        query = sorted(query, key=lambda wb: wb.added_at, reverse=True)
-
-    total = len(query)
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_books = [wb.book for wb in query[start:end]]
+    books, total = shelf_page("wishlist", wishlist.id, search, sort, page, per_page) if wishlist else ([], 0)
 
     return render_template(
         "books/wishlist.html",
-        books=paginated_books,
-        page=page,
+        books=books,
+        page=page if total else 1,
         total=total,
         per_page=per_page,
         search=search,
@@ -328,41 +298,21 @@ def search_wishlist():
     page = request.args.get("page", 1, type=int)
     search = request.args.get("search", "", type=str).strip().lower()
     sort = request.args.get("sort", "recent")
-    per_page = 12
+    per_page = SHELF_PAGE_SIZE
 
     wishlist = current_user.wishlist
     if not wishlist:
         return "", 204
 
-    query = wishlist.wishlist_books
-
-    if search:
-        query = [
-            wb for wb in query
-            if search in (wb.book.title or "").lower()
-            or search in (wb.book.authors or "").lower()
-        ]
-
-    if sort == "title_asc":
-        query = sorted(query, key=lambda wb: (wb.book.title or "").lower())
-    elif sort == "title_desc":
-        query = sorted(query, key=lambda wb: (wb.book.title or "").lower(), reverse=True)
-    elif sort == "oldest":
-        query = sorted(query, key=lambda wb: wb.added_at)
-    else:
-        query = sorted(query, key=lambda wb: wb.added_at, reverse=True)
-
-    total = len(query)
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_books = [wb.book for wb in query[start:end]]
+    books, total = shelf_page("wishlist", wishlist.id, search, sort, page, per_page)
 
-    wishlist_ids = [b.google_id for b in getattr(current_user.wishlist, "books", [])]
-    library_ids = [b.google_id for b in getattr(current_user.library, "books", [])]
+    membership = shelf_membership(current_user.id)
+    wishlist_ids = membership["wishlist"]
+    library_ids = membership["library"]
 
     return render_template(
         "books/_books_ajax.html",
-        books=paginated_books,
+        books=books,
         page=page,
         total=total,
         per_page=per_page,
@@ -380,10 +330,11 @@ def view_library():
     page = request.args.get("page", 1, type=int)
     sort = request.args.get("sort", "title_asc")
     search = request.args.get("search", "", type=str).strip().lower()
-    per_page = 12
+    per_page = SHELF_PAGE_SIZE
 
     library = current_user.library
-    if not library or not library.library_books:
+    books, total = shelf_page("library", library.id, search, sort, page, per_page) if library else ([], 0)
+    if total == 0:
         return render_template(
             "books/library.html",
             books=[],
@@ -397,31 +348,9 @@ def view_library():
             is_empty=True,
         )
 
-    query = library.library_books
-
-    if search:
-        query = [
-            lb for lb in query
-            if search in (lb.book.title or "").lower()
-            or search in (lb.book.authors or "").lower()
-        ]
-
-    if sort == "title_asc":
-        query = sorted(query, key=lambda lb: (lb.book.title or "").lower())
-    elif sort == "title_desc":
-        query = sorted(query, key=lambda lb: (lb.book.title or "").lower(), reverse=True)
-    elif sort == "oldest":
-        query = sorted(query, key=lambda lb: lb.added_at)
-    elif sort == "recent":
-        query = sorted(query, key=lambda lb: lb.added_at, reverse=True)
-
-    total = len(query)
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_books = [lb.book for lb in query[start:end]]
-
-    wishlist_ids = [b.google_id for b in getattr(current_user.wishlist, "books", [])]
-    library_ids = [lb.book.google_id for lb in library.library_books]
+    membership = shelf_membership(current_user.id)
+    wishlist_ids = membership["wishlist"]
+    library_ids = membership["library"]
 
     current_app.logger.info(
         f"[LIBRARY] Usuario {current_user.id} accedió a biblioteca con {total} libros."
@@ -429,7 +358,7 @@ def view_library():
 
     return render_template(
         "books/library.html",
-        books=paginated_books,
+        books=books,
         page=page,
         total=total,
         per_page=per_page,
@@ -437,7 +366,7 @@ def view_library():
         library_ids=library_ids,
         search=search,
         sort=sort,
-        is_empty=(total == 0),
+        is_empty=False,
     )
 
 
@@ -447,41 +376,21 @@ def search_library():
     page = request.args.get("page", 1, type=int)
     search = request.args.get("search", "", type=str).strip().lower()
     sort = request.args.get("sort", "title_asc")
-    per_page = 12
+    per_page = SHELF_PAGE_SIZE
 
     library = current_user.library
-    if not library or not library.library_books:
+    if not library:
         return "", 204
 
-    query = library.library_books
-
-    if search:
-        query = [
-            lb for lb in query
-            if search in (lb.book.title or "").lower()
-            or search in (lb.book.authors or "").lower()
-        ]
-
-    if sort == "title_asc":
-        query = sorted(query, key=lambda lb: (lb.book.title or "").lower())
-    elif sort == "title_desc":
-        query = sorted(query, key=lambda lb: (lb.book.title or "").lower(), reverse=True)
-    elif sort == "oldest":
-        query = sorted(query, key=lambda lb: lb.added_at)
-    elif sort == "recent":
-        query = sorted(query, key=lambda lb: lb.added_at, reverse=True)
+    books, total = shelf_page("library", library.id, search, sort, page, per_page)
 
-    total = len(query)
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_books = [lb.book for lb in query[start:end]]
-
-    wishlist_ids = [b.google_id for b in getattr(current_user.wishlist, "books", [])]
-    library_ids = [lb.book.google_id for lb in library.library_books]
+    membership = shelf_membership(current_user.id)
+    wishlist_ids = membership["wishlist"]
+    library_ids = membership["library"]
 
     return render_template(
         "books/_books_ajax.html",
-        books=paginated_books,
+        books=books,
         page=page,
         total=total,
         per_page=per_page,
@@ -492,23 +401,44 @@ def search_library():
     )
 
 
+@books_bp.route("/library/import", methods=["POST"])
+@login_required
+def import_library_csv():
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("Selecciona un archivo CSV para importar.", "warning")
+        return redirect(url_for("books.view_library"))
+    if not upload.filename.lower().endswith(".csv"):
+        flash("El archivo debe ser un CSV (por ejemplo, la exportación de Goodreads).", "warning")
+        return redirect(url_for("books.view_library"))
+
+    import_id = start_import(current_user.id, upload)
+    if not import_id:
+        flash("No se pudo iniciar la importación. Intenta más tarde.", "error")
+        return redirect(url_for("books.view_library"))
+
+    current_app.logger.info(f"[IMPORT] Usuario {current_user.id} inició la importación {import_id}.")
+    flash("Importación iniciada. Tus libros aparecerán en la biblioteca en unos minutos.", "info")
+    return redirect(url_for("books.view_library", import_id=import_id))
+
+
+@books_bp.route("/library/import/<import_id>")
+@login_required
+def library_import_status(import_id):
+    progress = import_progress(import_id, current_user.id)
+    if progress is None:
+        return {"error": "Importación no encontrada"}, 404
+    progress.pop("user_id", None)
+    return progress
+
+
 @books_bp.route("/book/<google_id>")
 @login_required
 def book_detail(google_id):
-    def is_cache_incomplete(data):
-        return (
-            not data.get("publisher")
-            or not data.get("authors")
-            or not data.get("thumbnail")
-            or not data.get("description")
-        )
-
     def flatten_categories(cats):
         return [part.strip() for cat in cats for part in cat.split("/") if part.strip()]
 
     book = Book.query.filter_by(google_id=google_id).first()
-    cache_key = f"book:{google_id}"
-    cached_data = cache.get(cache_key)
 
     if book:
         source = "db"
@@ -526,61 +456,43 @@ def book_detail(google_id):
             "source": source,
         }
 
-    elif cached_data:
+    else:
+        # Redis, then the durable volume store, then the API; "store" covers
+        # both of the latter, since get_stored_volume saves what the API returns.
         source = "cache"
-        raw_categories = cached_data.get("categories", [])
-        info = {
-            "title": cached_data.get("title", "Título no disponible"),
-            "authors": cached_data.get("authors", []),
-            "language": cached_data.get("language", "Idioma no disponible"),
-            "imageLinks": {"thumbnail": cached_data.get("thumbnail")} if cached_data.get("thumbnail") else {},
-            "description": clean_description(cached_data.get("description", "")) or "Descripción no disponible",
-            "publisher": cached_data.get("publisher", "Editorial no disponible"),
-            "publishedDate": cached_data.get("publishedDate", "Fecha no disponible"),
-            "categories": raw_categories,
-            "categories_flat": flatten_categories(raw_categories),
-            "isbn": cached_data.get("isbn"),
-            "source": source,
-        }
-        book = None
 
-    else:
+        def load_volume():
+            nonlocal source
+            source = "store"
+            return (get_stored_volume(google_id) or Volume(google_id=google_id)).to_summary()
+
         try:
-            api_key = current_app.config["GOOGLE_BOOKS_API_KEY"]
-            url = f"https://www.googleapis.com/books/v1/volumes/{google_id}"
-            response = requests.get(url, params={"key": api_key}, timeout=5)
-            volume = response.json().get("volumeInfo", {}) if response.status_code == 200 else {}
-        except requests.RequestException:
+            cached_data = swr_get(detail_cache_key(google_id), load_volume)
+        except GoogleBooksHTTPError:
+            cached_data = Volume(google_id=google_id).to_summary()
+        except GoogleBooksError:
             flash("No se pudo obtener los detalles del libro.", "error")
             return redirect(url_for("books.recommendations"))
 
-        source = "api"
-        raw_categories = volume.get("categories", [])
+        raw_categories = cached_data.get("categories", [])
         info = {
-            "title": volume.get("title", "Título no disponible"),
-            "authors": volume.get("authors", []),
-            "language": volume.get("language", "Idioma no disponible"),
-            "imageLinks": {"thumbnail": volume.get("imageLinks", {}).get("thumbnail")} if volume.get("imageLinks", {}).get("thumbnail") else {},
-            "description": clean_description(volume.get("description", "")) or "Descripción no disponible",
-            "publisher": volume.get("publisher", "Editorial no disponible").strip(),
-            "publishedDate": volume.get("publishedDate", "Fecha no disponible"),
+            "title": cached_data.get("title") or "Título no disponible",
+            "authors": cached_data.get("authors", []),
+            "language": cached_data.get("language") or "Idioma no disponible",
+            "imageLinks": {"thumbnail": cached_data.get("thumbnail")} if cached_data.get("thumbnail") else {},
+            "description": clean_description(cached_data.get("description", "")) or "Descripción no disponible",
+            "publisher": cached_data.get("publisher") or "Editorial no disponible",
+            "publishedDate": cached_data.get("publishedDate") or "Fecha no disponible",
             "categories": raw_categories,
             "categories_flat": flatten_categories(raw_categories),
-            "isbn": next(
-                (
-                    i["identifier"].replace("-", "").strip()
-                    for i in volume.get("industryIdentifiers", [])
-                    if i["type"] in ("ISBN_13", "ISBN_10")
-                ),
-                None,
-            ),
+            "isbn": cached_data.get("isbn"),
             "source": source,
         }
         book = None
-        cache.set(cache_key, info)
 
-    wishlist_ids = [b.google_id for b in getattr(current_user.wishlist, "books", [])]
-    library_ids = [b.google_id for b in getattr(current_user.library, "books", [])]
+    membership = shelf_membership(current_user.id)
+    wishlist_ids = membership["wishlist"]
+    library_ids = membership["library"]
 
     isbn = info.get("isbn")
 
@@ -611,18 +523,9 @@ def book_detail(google_id):
 @books_bp.route("/recommendations")
 @login_required
 def recommendations():
-    user_books = (
-        Book.query
-        .join(LibraryBook, LibraryBook.book_id == Book.id)
-        .join(UserLibrary, UserLibrary.id == LibraryBook.library_id)
-        .filter(UserLibrary.user_id == current_user.id)
-        .all()
-    )
+    user_categories = sorted(user_main_categories(current_user.id))
 
-    grouped = group_books_by_category(user_books)
-    user_categories = sorted(grouped.keys())
-
-    show_recommendation_ui = len(user_books) >= 3
+    show_recommendation_ui = len(shelf_membership(current_user.id)["library"]) >= 3
 
     return render_template(
         "books/recommendations.html",
@@ -635,67 +538,48 @@ def recommendations():
 @books_bp.route("/recommendations/fetch")
 @login_required
 def fetch_recommendations():
-    user_books = (
-        Book.query
-        .join(LibraryBook, LibraryBook.book_id == Book.id)
-        .join(UserLibrary, UserLibrary.id == LibraryBook.library_id)
-        .filter(UserLibrary.user_id == current_user.id)
-        .all()
-    )
-    if len(user_books) < 3:
-        return {"error": "Perfil insuficiente"}
-
     selected_category = request.args.get("selected_category", "").strip()
     selected_categories = [selected_category] if selected_category and selected_category.lower() not in ("undefined", "null") else None
 
-    profile_vector, vectorizer, profile_hash = build_user_profile(
-        user_books, selected_categories=selected_categories
+    # The ranking's key only needs the library version, so a cached page is
+    # served without loading the library or the profile sums.
+    version = read_library_version(current_user.id)
+    _, model_version = get_shared_vectorizer()
+    page = next_recommendation_page(current_user.id, profile_key(version, model_version, selected_categories))
+    if page:
+        current_app.logger.info(f"[RECOMMEND] Usuario {current_user.id} recibió lote desde caché.")
+        return current_app.response_class(
+            '{"books":[' + ",".join(page) + "]}",
+            mimetype="application/json",
+        )
+
+    # Read after the version, as get_library_snapshot does.
+    user_books = get_user_library_books(current_user.id)
+    if len(user_books) < 3:
+        return {"error": "Perfil insuficiente"}
+
+    profile_vector, vectorizer, ranking_key = get_user_profile(
+        current_user.id, user_books, selected_categories=selected_categories, version=version
     )
     if profile_vector is None:
         current_app.logger.info(f"[RECOMMEND] Perfil vacío para usuario {current_user.id}.")
         return {"error": "No se pudo construir el perfil"}
 
-    cache_key = f"recommendations:{current_user.id}:{profile_hash}"
-    rotation_key = f"recommendations_rotation:{current_user.id}:{profile_hash}"
-
-    cached_data = cache.get(cache_key)
-    rotation_index = cache.get(rotation_key) or 0
-
-    if cached_data:
-        if rotation_index >= len(cached_data):
-            current_app.logger.info(f"[RECOMMEND] Caché agotada para perfil {profile_hash}. Regenerando.")
-            cached_data = None
-        else:
-            chunk = cached_data[rotation_index:rotation_index + 3]
-            cache.set(rotation_key, (rotation_index + 3) % len(cached_data))
-            current_app.logger.info(f"[RECOMMEND] Usuario {current_user.id} recibió lote {rotation_index} desde caché.")
-            return {"books": chunk}
-
-    shown_ids = set()
-    api_key = current_app.config.get("GOOGLE_BOOKS_API_KEY")
-    recommendations = fetch_google_books(
+    recommendations = rank_recommendations(
         profile_vector,
         vectorizer,
-        api_key,
         user_books,
-        shown_ids,
-        selected_categories=selected_categories,
-        min_similarity=0.2,
+        selected_categories,
     )
 
     if recommendations:
-        for r in recommendations:
-            if "similarity" in r:
-                r["similarity"] = float(r["similarity"])
+        store_recommendations(current_user.id, ranking_key, recommendations, rotation_index=3)
         valid_scores = [r["similarity"] for r in recommendations if "similarity" in r]
         avg_score = np.mean(valid_scores) if valid_scores else 0
-        current_app.logger.info(f"[RECOMMEND] {len(recommendations)} libros generados para perfil {profile_hash}. Similitud promedio: {avg_score:.3f}")
-
-        cache.set(cache_key, recommendations, timeout=172800)  # 48h
-        cache.set(rotation_key, 3)
+        current_app.logger.info(f"[RECOMMEND] {len(recommendations)} libros generados para perfil {ranking_key}. Similitud promedio: {avg_score:.3f}")
         return {"books": recommendations[0:3]}
 
-    current_app.logger.info(f"[RECOMMEND] Sin resultados útiles para perfil {profile_hash}.")
+    current_app.logger.info(f"[RECOMMEND] Sin resultados útiles para perfil {ranking_key}.")
     return {
         "books": [],
         "message": "No se encontraron recomendaciones relevantes en este momento. Intenta más tarde o agrega más libros a tu biblioteca."
@@ -716,19 +600,16 @@ def resolve_isbn(isbn):
         flash("ISBN inválido. Debe tener 13 dígitos y comenzar con 978 o 979.", "warning")
         return redirect(url_for("books.search_books"))
 
-    api_key = current_app.config["GOOGLE_BOOKS_API_KEY"]
-    params = {"q": f"isbn:{isbn}", "maxResults": 1, "key": api_key}
-
     try:
-        response = requests.get("https://www.googleapis.com/books/v1/volumes", params=params, timeout=5)
-        items = response.json().get("items", []) if response.status_code == 200 else []
-    except requests.RequestException:
+        google_id = google_id_for_isbn(isbn)
+    except GoogleBooksHTTPError:
+        google_id = None
+    except GoogleBooksError:
         flash("No se pudo buscar el ISBN.", "error")
         return redirect(url_for("books.search_books"))
 
-    if not items:
+    if not google_id:
         flash("No se encontró ningún libro con ese ISBN.", "warning")
         return redirect(url_for("books.search_books"))
 
-    google_id = items[0]["id"]
     return redirect(url_for("books.book_detail", google_id=google_id))
@@ -0,0 +1,183 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app.extensions import redis_client
+
+# Token bucket refilled at `rate` tokens/s up to `burst`, plus a per-day call
+# counter, checked and charged atomically. Returns 0 when a token was taken,
+# -1 when the daily quota is spent, or the milliseconds until the next token.
+_TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local daily_limit = tonumber(ARGV[3])
+
+if daily_limit > 0 and tonumber(redis.call('GET', KEYS[2]) or '0') >= daily_limit then
+    return -1
+end
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now_ms
+tokens = math.min(burst, tokens + (now_ms - ts) * rate / 1000)
+
+if tokens < 1 then
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now_ms)
+    redis.call('PEXPIRE', KEYS[1], 60000)
+    return math.ceil((1 - tokens) * 1000 / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens - 1, 'ts', now_ms)
+redis.call('PEXPIRE', KEYS[1], 60000)
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], 172800)
+return 0
+"""
+_take_token = redis_client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+BUCKET_KEY = "gbooks:bucket"
+BREAKER_FAILURES_KEY = "gbooks:breaker:failures"
+BREAKER_OPEN_KEY = "gbooks:breaker:open"
+BREAKER_TRIPPED_KEY = "gbooks:breaker:tripped"
+BREAKER_PROBE_KEY = "gbooks:breaker:probe"
+
+
+# Background jobs may wait much longer for a token than a request should.
+_queue_wait = ContextVar("api_queue_wait", default=None)
+# Absolute time.monotonic() after which no new attempt or backoff is started.
+_call_deadline = ContextVar("api_call_deadline", default=None)
+
+
+class ApiUnavailable(Exception):
+    pass
+
+
+@contextmanager
+def queue_wait(seconds):
+    token = _queue_wait.set(seconds)
+    try:
+        yield
+    finally:
+        _queue_wait.reset(token)
+
+
+@contextmanager
+def call_deadline(until):
+    token = _call_deadline.set(until)
+    try:
+        yield
+    finally:
+        _call_deadline.reset(token)
+
+
+def time_left():
+    # Seconds until the current call deadline, or None when there is none.
+    until = _call_deadline.get()
+    return None if until is None else until - time.monotonic()
+
+
+def daily_quota_key():
+    return f"gbooks:quota:{datetime.utcnow():%Y%m%d}"
+
+
+def quota_exhausted():
+    # True once today's GOOGLE_BOOKS_DAILY_QUOTA calls have all been made.
+    daily_limit = current_app.config.get("GOOGLE_BOOKS_DAILY_QUOTA", 0)
+    if not daily_limit:
+        return False
+    try:
+        return int(redis_client.get(daily_quota_key()) or 0) >= daily_limit
+    except RedisError:
+        return False
+
+
+def acquire_token(max_wait=None):
+    # Blocks for at most max_wait seconds waiting for a token shared by every
+    # worker and node; raises ApiUnavailable rather than queueing longer.
+    config = current_app.config
+    rate = config.get("GOOGLE_BOOKS_RATE_PER_SECOND", 5)
+    burst = config.get("GOOGLE_BOOKS_BURST", 10)
+    daily_limit = config.get("GOOGLE_BOOKS_DAILY_QUOTA", 0)
+    if max_wait is None:
+        max_wait = _queue_wait.get()
+    if max_wait is None:
+        max_wait = config.get("GOOGLE_BOOKS_MAX_QUEUE_WAIT", 0.5)
+    quota_key = daily_quota_key()
+
+    deadline = time.monotonic() + max_wait
+    while True:
+        try:
+            wait_ms = _take_token(keys=[BUCKET_KEY, quota_key], args=[rate, burst, daily_limit])
+        except RedisError as e:
+            current_app.logger.warning(f"[GBOOKS] Limitador no disponible, se permite la llamada: {e}")
+            return
+        if wait_ms == 0:
+            return
+        if wait_ms < 0:
+            raise ApiUnavailable("Cuota diaria de Google Books agotada")
+        if time.monotonic() + wait_ms / 1000 > deadline:
+            raise ApiUnavailable("Límite de peticiones por segundo de Google Books")
+        time.sleep(wait_ms / 1000)
+
+
+# Circuit breaker shared through Redis. After `threshold` failures inside
+# `window` seconds it opens for `cooldown` seconds and every call fails fast.
+# Once the cooldown passes it is half-open: a single probe call goes through,
+# and its outcome either closes the breaker or opens it again. Returns True
+# when the caller took the probe.
+def breaker_allow():
+    config = current_app.config
+    try:
+        if redis_client.exists(BREAKER_OPEN_KEY):
+            raise ApiUnavailable("Circuito de Google Books abierto")
+        if redis_client.exists(BREAKER_TRIPPED_KEY):
+            probe_ttl = int(config.get("GOOGLE_BOOKS_BREAKER_COOLDOWN", 30))
+            if not redis_client.set(BREAKER_PROBE_KEY, 1, nx=True, ex=probe_ttl):
+                raise ApiUnavailable("Circuito de Google Books en prueba")
+            return True
+    except RedisError:
+        pass
+    return False
+
+
+def breaker_release_probe():
+    try:
+        redis_client.delete(BREAKER_PROBE_KEY)
+    except RedisError:
+        pass
+
+
+def breaker_success():
+    try:
+        if redis_client.exists(BREAKER_TRIPPED_KEY) or redis_client.exists(BREAKER_FAILURES_KEY):
+            redis_client.delete(BREAKER_FAILURES_KEY, BREAKER_TRIPPED_KEY, BREAKER_PROBE_KEY)
+    except RedisError:
+        pass
+
+
+def breaker_failure():
+    config = current_app.config
+    threshold = config.get("GOOGLE_BOOKS_BREAKER_THRESHOLD", 5)
+    window = int(config.get("GOOGLE_BOOKS_BREAKER_WINDOW", 30))
+    cooldown = int(config.get("GOOGLE_BOOKS_BREAKER_COOLDOWN", 30))
+    try:
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.incr(BREAKER_FAILURES_KEY)
+        pipe.expire(BREAKER_FAILURES_KEY, window)
+        pipe.exists(BREAKER_TRIPPED_KEY)
+        failures, _, probing = pipe.execute()
+        if probing or failures >= threshold:
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.set(BREAKER_OPEN_KEY, 1, ex=cooldown)
+            pipe.set(BREAKER_TRIPPED_KEY, 1, ex=cooldown * 10)
+            pipe.delete(BREAKER_PROBE_KEY, BREAKER_FAILURES_KEY)
+            pipe.execute()
+            current_app.logger.error(f"[GBOOKS] Circuito abierto por {cooldown}s tras {failures} fallos.")
+    except RedisError:
+        pass
@@ -0,0 +1,174 @@
+import re
+import unicodedata
+from collections import Counter
+
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy import func, insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.extensions import db, redis_client
+from app.models import Author, Book, BookAuthor, BookCategory, Category, LibraryBook, UserLibrary
+from app.utils.categories import map_to_main_category
+from app.utils.jobs import job, enqueue
+from app.utils.text import normalize_categories, truncate
+
+INDEX_BATCH = 500
+BACKFILL_REQUEST_KEY = "books:index:requested"
+BACKFILL_REQUEST_TTL = 3600
+
+
+def name_key(name):
+    # "García  Márquez" and "garcia marquez" share one key.
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(ch for ch in name if not unicodedata.combining(ch))
+    return truncate(re.sub(r"[^\w\s]", "", " ".join(name.lower().split())), 255)
+
+
+def insert_ignore(model, rows):
+    # Rows whose unique key already exists are skipped, on MySQL and SQLite alike.
+    if rows:
+        stmt = insert(model).prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite")
+        db.session.execute(stmt, rows)
+
+
+def split_authors(authors):
+    return [a.strip() for a in (authors or "").split(",") if a.strip()]
+
+
+def split_categories(categories):
+    return normalize_categories((categories or "").split(","))
+
+
+def index_book_metadata(books):
+    # books: {book_id: (authors string, categories string)}, as stored on Book.
+    # Links each book to its Author and Category rows, creating the missing
+    # ones with their CATEGORY_GROUPS main group. Idempotent; commits once.
+    authors = {name_key(a): a for value, _ in books.values() for a in split_authors(value)}
+    categories = {name_key(c): c for _, value in books.values() for c in split_categories(value)}
+    authors.pop("", None)
+    categories.pop("", None)
+
+    insert_ignore(Author, [{"name": truncate(name, 255), "name_key": key} for key, name in authors.items()])
+    insert_ignore(Category, [
+        {"name": truncate(name, 255), "name_key": key, "main_category": map_to_main_category(name)}
+        for key, name in categories.items()
+    ])
+    # Re-keyed because the collation can return a row stored under an older,
+    # accented key for one of ours.
+    author_ids = {
+        name_key(key): author_id for key, author_id in
+        db.session.query(Author.name_key, Author.id).filter(Author.name_key.in_(list(authors)))
+    }
+    category_ids = {
+        name_key(key): category_id for key, category_id in
+        db.session.query(Category.name_key, Category.id).filter(Category.name_key.in_(list(categories)))
+    }
+
+    insert_ignore(BookAuthor, [
+        {"book_id": book_id, "author_id": author_ids[key]}
+        for book_id, (value, _) in books.items()
+        for key in {name_key(a) for a in split_authors(value)} if key in author_ids
+    ])
+    insert_ignore(BookCategory, [
+        {"book_id": book_id, "category_id": category_ids[key]}
+        for book_id, (_, value) in books.items()
+        for key in {name_key(c) for c in split_categories(value)} if key in category_ids
+    ])
+    db.session.commit()
+
+
+def request_backfill():
+    # Queues the books.index backfill at most once per BACKFILL_REQUEST_TTL.
+    try:
+        if redis_client.set(BACKFILL_REQUEST_KEY, 1, nx=True, ex=BACKFILL_REQUEST_TTL):
+            enqueue("books.index")
+    except RedisError as e:
+        current_app.logger.warning(f"[BOOKS] No se pudo pedir la indexación: {e}")
+
+
+def index_new_books(books):
+    # Indexes books whose rows are already committed. A failure (e.g. the
+    # tables don't exist yet) never fails the write that created them; the
+    # backfill indexes them later.
+    try:
+        index_book_metadata(books)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.warning(f"[BOOKS] No se pudieron indexar {len(books)} libros: {e}")
+        request_backfill()
+
+
+@job("books.index")
+def backfill_book_metadata(batch_size=INDEX_BATCH):
+    # Indexes every book in id order, then re-maps existing categories so a
+    # change to CATEGORY_GROUPS reaches rows created before it.
+    last_id, total = 0, 0
+    while True:
+        rows = (
+            db.session.query(Book.id, Book.authors, Book.categories)
+            .filter(Book.id > last_id)
+            .order_by(Book.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        index_book_metadata({book_id: (authors, categories) for book_id, authors, categories in rows})
+        last_id = rows[-1][0]
+        total += len(rows)
+
+    remapped = 0
+    for category in Category.query.yield_per(batch_size):
+        main_category = map_to_main_category(category.name)
+        if category.main_category != main_category:
+            category.main_category = main_category
+            remapped += 1
+    db.session.commit()
+    current_app.logger.info(f"[BOOKS] {total} libros indexados, {remapped} categorías reasignadas.")
+    return total
+
+
+def _library_query(user_id, *columns):
+    return (
+        db.session.query(*columns)
+        .join(LibraryBook, LibraryBook.book_id == Book.id)
+        .join(UserLibrary, UserLibrary.id == LibraryBook.library_id)
+        .filter(UserLibrary.user_id == user_id)
+    )
+
+
+def user_main_categories(user_id):
+    # {main category: number of the user's books in it}, as one GROUP BY over
+    # the indexed book_categories join. While some of the library's categorized
+    # books have no indexed rows yet (shelved before the tables existed), the
+    # whole library is counted from the Book.categories strings instead and the
+    # backfill is requested.
+    categorized = _library_query(user_id, func.count(Book.id)).filter(
+        Book.categories.isnot(None), Book.categories != ""
+    ).scalar()
+    if not categorized:
+        return {}
+    try:
+        indexed = (
+            _library_query(user_id, func.count(func.distinct(BookCategory.book_id)))
+            .join(BookCategory, BookCategory.book_id == Book.id)
+            .scalar()
+        )
+        if indexed >= categorized:
+            return dict(
+                _library_query(user_id, Category.main_category, func.count(func.distinct(Book.id)))
+                .join(BookCategory, BookCategory.book_id == Book.id)
+                .join(Category, Category.id == BookCategory.category_id)
+                .group_by(Category.main_category)
+            )
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.warning(f"[BOOKS] Índice de categorías no disponible: {e}")
+
+    counts = Counter()
+    books = _library_query(user_id, Book.categories).filter(Book.categories.isnot(None))
+    for (categories,) in books:
+        counts.update({map_to_main_category(c) for c in split_categories(categories)})
+    request_backfill()
+    return dict(counts)
@@ -1,44 +1,18 @@
-import re
-import html
-import ftfy
-import requests
 from flask import flash, current_app
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from app.models import Book
 from app.extensions import db
+from app.utils.book_index import index_new_books
+from app.utils.google_books import GoogleBooksError, GoogleBooksHTTPError, call_budget
+from app.utils.singleflight import single_flight
+from app.utils.text import normalize_categories, clean_description, truncate, force_https
+from app.utils.volume_store import get_stored_volume
 
-def normalize_categories(raw_categories):
-    flat = set()
-    for cat in raw_categories:
-        if not cat:
-            continue
-        parts = re.split(r"[\/,]", cat)
-        for part in parts:
-            cleaned = part.strip()
-            if cleaned:
-                flat.add(cleaned)
-    return list(flat)
-
-def clean_description(text):
-    if not text:
-        return ""
-    text = ftfy.fix_text(text)
-    text = html.unescape(text)
-    text = re.sub(r"<[^>]+>", " ", text)
-    text = re.sub(r"http\S+|www\.\S+", " ", text)
-    text = re.sub(r"[\n\r\t]+", " ", text)
-    text = re.sub(r"\s{2,}", " ", text)
-    return text.strip()
-
-def truncate(value, max_length):
-    return value[:max_length] if value and len(value) > max_length else value
+# Seconds allowed for the Book upsert and its indexing after the volume lookup.
+BOOK_WRITE_BUDGET = 2.0
 
 def get_or_create_book(google_id, title, authors, thumbnail, language, isbn=None, categories_raw=None):
-    def force_https(url):
-        if url and url.startswith("http://"):
-            return url.replace("http://", "https://")
-        return url
-
     google_id = google_id.strip() if google_id else None
     if not google_id or not title:
         flash("Missing essential book data.", "error")
@@ -60,92 +34,149 @@ def get_or_create_book(google_id, title, authors, thumbnail, language, isbn=None
             current_app.logger.info(f"[BOOK] Retrieved by ISBN: {book.title} ({book.google_id})")
             return book
 
-    # Fetch from Google Books API
-    try:
-        response = requests.get(
-            f"https://www.googleapis.com/books/v1/volumes/{google_id}",
-            params={"key": current_app.config["GOOGLE_BOOKS_API_KEY"]},
-            timeout=5
+    # Only one worker fetches a given volume; the upsert makes the write itself
+    # race-free, so concurrent shelving of the same book can't fail. Followers
+    # wait for the volume lookup plus the write.
+    book_id = single_flight(
+        f"book:create:{google_id}",
+        lambda: create_book_from_api(google_id, title, authors, thumbnail, language, isbn),
+        wait=call_budget("volume") + BOOK_WRITE_BUDGET,
+    )
+    if not book_id:
+        return None
+    book = db.session.get(Book, book_id)
+    if book is None:
+        # Row committed by another worker after our snapshot began: a locking
+        # read sees the latest committed version without ending the caller's
+        # transaction.
+        book = (
+            db.session.query(Book)
+            .filter(Book.id == book_id)
+            .with_for_update(read=True)
+            .populate_existing()
+            .first()
         )
-    except requests.RequestException as e:
-        flash("Failed to connect to Google Books API. Try again later.", "error")
-        current_app.logger.error(f"[BOOK] Connection error: {e}")
+    return book
+
+def book_values(volume, title=None, authors=None, thumbnail=None, language=None, isbn=None):
+    # Column values for a Book built from an API volume. The optional arguments
+    # are what the user saw when shelving it: title and language take
+    # precedence, authors, thumbnail and ISBN only fill gaps in the volume.
+    # Returns None when essential data is missing.
+    title = title or volume.title
+    language = language or volume.language
+    final_authors = volume.authors if volume.authors else authors or []
+    authors_string = ", ".join(final_authors)
+
+    thumbnail_url = force_https(volume.thumbnail or volume.small_thumbnail or thumbnail)
+    small_thumbnail_url = force_https(volume.small_thumbnail or volume.thumbnail or thumbnail_url)
+
+    # Prefer ISBN-13, fallback to ISBN-10
+    isbn = volume.isbn or isbn
+    isbn = isbn if isbn and isbn.lower() != "none" else None
+
+    if not all([volume.google_id, title, authors_string, language]):
         return None
 
-    if response.status_code != 200:
+    return {
+        "google_id": volume.google_id,
+        "title": truncate(title, 255),
+        "authors": truncate(authors_string, 255),
+        "categories": truncate(", ".join(volume.categories) if volume.categories else "", 1000),
+        "language": truncate(language, 20),
+        "isbn": truncate(isbn, 20),
+        "thumbnail": truncate(thumbnail_url, 500),
+        "small_thumbnail": truncate(small_thumbnail_url, 500),
+        "description": clean_description(volume.description),
+        "publisher": truncate(volume.publisher, 255),
+        "published_date": truncate(volume.published_date, 20),
+    }
+
+def upsert_statement():
+    # INSERT that leaves an existing row (same google_id) untouched instead of
+    # failing: ON DUPLICATE KEY UPDATE on MySQL, ON CONFLICT on SQLite. On
+    # MySQL, id = LAST_INSERT_ID(id) makes lastrowid the existing row's id.
+    if db.engine.dialect.name == "mysql":
+        stmt = mysql_insert(Book)
+        return stmt.on_duplicate_key_update(id=db.func.last_insert_id(Book.id))
+    stmt = sqlite_insert(Book)
+    return stmt.on_conflict_do_update(index_elements=["google_id"], set_={"google_id": stmt.excluded.google_id})
+
+
+def upsert_book(values):
+    # Creates the Book (or finds the existing one) in one statement and
+    # returns its id. Commits, so the row is visible to the next read.
+    stmt = upsert_statement()
+    if db.engine.dialect.name == "mysql":
+        book_id = db.session.execute(stmt, values).lastrowid
+    else:
+        book_id = db.session.execute(stmt.returning(Book.id), values).scalar_one()
+    db.session.commit()
+    index_new_books({book_id: (values["authors"], values["categories"])})
+    return book_id
+
+
+def upsert_books(rows):
+    # Bulk form of upsert_book: writes every row in one statement and returns
+    # {google_id: book_id}, with the ids read back in a single SELECT.
+    if not rows:
+        return {}
+    db.session.execute(upsert_statement(), rows)
+    db.session.commit()
+    google_ids = [row["google_id"] for row in rows]
+    ids = dict(db.session.query(Book.google_id, Book.id).filter(Book.google_id.in_(google_ids)))
+    index_new_books({
+        ids[row["google_id"]]: (row["authors"], row["categories"]) for row in rows if row["google_id"] in ids
+    })
+    return ids
+
+
+def ensure_books(volumes):
+    # Bulk get-or-create: returns {google_id: book_id} for every volume that is
+    # already a Book or has enough data to become one.
+    by_id = {v.google_id: v for v in volumes if v is not None and v.google_id}
+    if not by_id:
+        return {}
+    ids = dict(db.session.query(Book.google_id, Book.id).filter(Book.google_id.in_(list(by_id))))
+
+    rows = []
+    for gid, volume in by_id.items():
+        if gid not in ids:
+            values = book_values(volume)
+            if values is not None:
+                rows.append(values)
+    ids.update(upsert_books(rows))
+    return ids
+
+def create_book_from_api(google_id, title, authors, thumbnail, language, isbn=None):
+    # Volume store first, Google Books API on a miss
+    try:
+        volume = get_stored_volume(google_id)
+    except GoogleBooksHTTPError as e:
         flash("Could not retrieve book information from Google Books.", "error")
-        current_app.logger.warning(f"[BOOK] Invalid response for {google_id}: {response.status_code}")
+        current_app.logger.warning(f"[BOOK] Invalid response for {google_id}: {e.status}")
+        return None
+    except GoogleBooksError as e:
+        flash("Failed to connect to Google Books API. Try again later.", "error")
+        current_app.logger.error(f"[BOOK] Connection error: {e}")
         return None
 
-    data = response.json()
-    volume = data.get("volumeInfo", {})
     if not volume:
         flash("No valid book information found.", "error")
         current_app.logger.warning(f"[BOOK] Empty volumeInfo for {google_id}")
         return None
 
-    # Extract metadata
-    api_authors = volume.get("authors", [])
-    final_authors = api_authors if api_authors else authors or []
-    authors_string = ", ".join(final_authors)
-
-    description = clean_description(volume.get("description", ""))
-    categories = volume.get("categories", [])
-    categories_text = ", ".join(categories) if categories else ""
-
-    image_links = volume.get("imageLinks", {})
-    thumbnail_url = force_https(image_links.get("thumbnail") or image_links.get("smallThumbnail") or thumbnail)
-    small_thumbnail_url = force_https(image_links.get("smallThumbnail") or image_links.get("thumbnail") or thumbnail_url)
-
-    published_date = volume.get("publishedDate", "")
-    publisher = volume.get("publisher", "")
-
-    # Prefer ISBN-13, fallback to ISBN-10
-    isbn_13 = None
-    isbn_10 = None
-    for identifier in volume.get("industryIdentifiers", []):
-        if identifier.get("type") == "ISBN_13":
-            isbn_13 = identifier.get("identifier")
-        elif identifier.get("type") == "ISBN_10":
-            isbn_10 = identifier.get("identifier")
-    isbn = isbn_13 or isbn_10 or isbn
-    isbn = isbn if isbn and isbn.lower() != "none" else None
-
-    # Final validation
-    if not all([google_id, title, authors_string, language]):
+    values = book_values(volume, title, authors, thumbnail, language, isbn)
+    if values is None:
         flash("Book creation failed. Missing essential data.", "error")
-        current_app.logger.warning(f"[BOOK] Incomplete data: id={google_id}, title={title}, authors={authors_string}, language={language}")
+        current_app.logger.warning(f"[BOOK] Incomplete data: id={google_id}, title={title}, language={language}")
         return None
 
-    # Create book object
-    book = Book(
-        google_id=google_id,
-        title=truncate(title, 255),
-        authors=truncate(authors_string, 255),
-        categories=truncate(categories_text, 1000),
-        language=truncate(language, 20),
-        isbn=truncate(isbn, 20),
-        thumbnail=truncate(thumbnail_url, 500),
-        small_thumbnail=truncate(small_thumbnail_url, 500),
-        description=description,
-        publisher=truncate(publisher, 255),
-        published_date=truncate(published_date, 20),
-    )
-
     # Warn if metadata is incomplete
-    if not book.authors or not book.thumbnail or not book.isbn:
+    if not values["authors"] or not values["thumbnail"] or not values["isbn"]:
         flash("El libro se agregó con datos incompletos", "info")
-        current_app.logger.warning(f"[BOOK] Incomplete metadata: {book.title} ({book.google_id}) → authors={book.authors}, thumbnail={book.thumbnail}, isbn={book.isbn}")
+        current_app.logger.warning(f"[BOOK] Incomplete metadata: {values['title']} ({google_id}) → authors={values['authors']}, thumbnail={values['thumbnail']}, isbn={values['isbn']}")
 
-    # Save to database
-    try:
-        db.session.add(book)
-        db.session.commit()
-        current_app.logger.info(f"[BOOK] Book created: {book.title} ({book.google_id})")
-    except IntegrityError:
-        db.session.rollback()
-        flash("Book already exists. Loaded from database.", "info")
-        current_app.logger.warning(f"[BOOK] Duplicate detected during insert: {google_id}")
-        book = Book.query.filter_by(google_id=google_id).first()
-
-    return book
+    book_id = upsert_book(values)
+    current_app.logger.info(f"[BOOK] Book saved: {values['title']} ({google_id})")
+    return book_id
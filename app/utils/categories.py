@@ -0,0 +1,57 @@
+import re
+from functools import lru_cache
+
+CATEGORY_GROUPS = {
+    "Ficción": ["Fiction", "Literary Fiction", "Contemporary Fiction", "Short Stories"],
+    "Romance": ["Romance", "Historical Romance", "Paranormal Romance", "Chick Lit"],
+    "Misterio y Suspenso": ["Mystery", "Thriller", "Crime", "Suspense", "Detective"],
+    "Ciencia ficción": ["Science Fiction", "Dystopian", "Space Opera", "Cyberpunk"],
+    "Fantasía": ["Fantasy", "Epic Fantasy", "Urban Fantasy", "Dark Fantasy"],
+    "Terror": ["Horror", "Supernatural", "Gothic", "Occult"],
+    "Biografía y Memorias": ["Biography", "Memoir", "Autobiography", "Personal Memoirs"],
+    "Historia": ["History", "Military History", "World History", "Ancient Civilizations"],
+    "Autoayuda y Bienestar": ["Self-Help", "Motivation", "Mental Health", "Wellness", "Productivity"],
+    "Negocios y Economía": ["Business", "Economics", "Finance", "Leadership", "Entrepreneurship"],
+    "Ciencia y Tecnología": ["Science", "Technology", "Physics", "Biology", "AI", "Engineering"],
+    "Juvenil": ["Young Adult", "YA Romance", "YA Fantasy", "Coming of Age"],
+    "Poesía": ["Poetry", "Verse", "Anthology", "Contemporary Poetry"],
+    "Filosofía y Religión": ["Philosophy", "Religion", "Spirituality", "Theology", "Ethics"],
+    "Educación y Aprendizaje": ["Education", "Pedagogy", "Study Guides", "Teaching", "Academic Skills"],
+    "Familia y Relaciones": ["Parenting", "Relationships", "Family", "Marriage", "Dating"],
+    "Arte y Diseño": ["Art", "Design", "Photography", "Architecture", "Graphic Design"],
+    "Viajes y Aventura": ["Travel", "Adventure", "Travel Guides", "Exploration", "Cultural Travel"],
+    "Cocina y Gastronomía": ["Cooking", "Cookbooks", "Food", "Nutrition", "Culinary Arts"],
+    "Política y Sociedad": ["Politics", "Sociology", "Current Affairs", "Social Issues", "Civic Engagement"],
+    "Cómics y Novelas gráficas": ["Comics", "Graphic Novels", "Manga", "Webcomics"],
+    "Infantil": ["Children", "Picture Books", "Early Readers", "Middle Grade"]
+}
+
+# Alternatives are ordered by CATEGORY_GROUPS priority and wrapped in a
+# lookahead, so at every position the regex reports the highest-priority
+# subcategory starting there (overlapping matches included). The lowest group
+# index over all positions is exactly the first group the old substring scan
+# would have matched.
+_SUBCATEGORY_GROUP = {}
+for _index, (_main_cat, _subcats) in enumerate(CATEGORY_GROUPS.items()):
+    for _sub in _subcats:
+        _SUBCATEGORY_GROUP.setdefault(_sub.lower(), _index)
+_MAIN_CATEGORIES = list(CATEGORY_GROUPS)
+_CATEGORY_PATTERN = re.compile(
+    "(?=(" + "|".join(
+        re.escape(sub) for sub in sorted(_SUBCATEGORY_GROUP, key=lambda sub: _SUBCATEGORY_GROUP[sub])
+    ) + "))"
+)
+
+
+@lru_cache(maxsize=4096)
+def map_to_main_category(raw_category):
+    if not raw_category:
+        return "Other"
+    best = None
+    for match in _CATEGORY_PATTERN.finditer(raw_category.lower()):
+        index = _SUBCATEGORY_GROUP[match.group(1)]
+        if best is None or index < best:
+            best = index
+            if best == 0:
+                break
+    return _MAIN_CATEGORIES[best] if best is not None else "Other"
@@ -0,0 +1,168 @@
+from array import array
+
+import numpy as np
+from flask import current_app
+from scipy import sparse
+from sqlalchemy import func, insert
+from sqlalchemy.orm import selectinload
+
+from app.extensions import db
+from app.models import Book, BookNeighbor, LibraryBook, UserLibrary, Wishlist, WishlistBook
+from app.utils.books import normalize_categories
+from app.utils.categories import map_to_main_category
+from app.utils.jobs import job
+
+WISHLIST_WEIGHT = 0.5
+INSERT_BATCH = 5000
+
+
+def load_shelf_matrix(batch_size=10000):
+    # Streams library and wishlist rows into a sparse book x user matrix.
+    # Returns (matrix, book_ids) where row i belongs to book_ids[i].
+    books, users, weights = array("q"), array("q"), array("f")
+
+    sources = (
+        (db.session.query(LibraryBook.book_id, UserLibrary.user_id)
+            .join(UserLibrary, UserLibrary.id == LibraryBook.library_id), 1.0),
+        (db.session.query(WishlistBook.book_id, Wishlist.user_id)
+            .join(Wishlist, Wishlist.id == WishlistBook.wishlist_id), WISHLIST_WEIGHT),
+    )
+    for query, weight in sources:
+        for book_id, user_id in query.yield_per(batch_size):
+            books.append(book_id)
+            users.append(user_id)
+            weights.append(weight)
+
+    if not books:
+        return None, None
+
+    book_ids, book_rows = np.unique(np.frombuffer(books, dtype=np.int64), return_inverse=True)
+    _, user_cols = np.unique(np.frombuffer(users, dtype=np.int64), return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.frombuffer(weights, dtype=np.float32), (book_rows, user_cols)),
+        shape=(len(book_ids), user_cols.max() + 1),
+    )
+    matrix.sum_duplicates()
+    return matrix, book_ids
+
+
+def top_k_neighbors(matrix, top_k=20, min_score=0.05, chunk_size=2000):
+    # Item-item cosine similarity computed one block of rows at a time, so
+    # peak memory is bounded by a chunk_size x n_books sparse product.
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    normalized = sparse.diags(1.0 / norms).dot(matrix).tocsr()
+    transposed = normalized.T.tocsc()
+
+    for start in range(0, normalized.shape[0], chunk_size):
+        block = (normalized[start:start + chunk_size] @ transposed).tocsr()
+        for offset in range(block.shape[0]):
+            row = start + offset
+            lo, hi = block.indptr[offset], block.indptr[offset + 1]
+            cols, scores = block.indices[lo:hi], block.data[lo:hi]
+            mask = (cols != row) & (scores >= min_score)
+            cols, scores = cols[mask], scores[mask]
+            if len(cols) > top_k:
+                keep = np.argpartition(-scores, top_k - 1)[:top_k]
+                cols, scores = cols[keep], scores[keep]
+            yield row, cols, scores
+
+
+@job("recommendations.neighbors")
+def build_item_neighbors(top_k=20, min_score=0.05):
+    matrix, book_ids = load_shelf_matrix()
+    if matrix is None:
+        current_app.logger.info("[NEIGHBORS] Sin datos de estanterías.")
+        return 0
+
+    db.session.query(BookNeighbor).delete(synchronize_session=False)
+    batch, total = [], 0
+    for row, cols, scores in top_k_neighbors(matrix, top_k=top_k, min_score=min_score):
+        book_id = int(book_ids[row])
+        batch.extend(
+            {"book_id": book_id, "neighbor_id": int(book_ids[c]), "score": float(s)}
+            for c, s in zip(cols, scores)
+        )
+        if len(batch) >= INSERT_BATCH:
+            db.session.execute(insert(BookNeighbor), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(BookNeighbor), batch)
+        total += len(batch)
+    db.session.commit()
+
+    current_app.logger.info(
+        f"[NEIGHBORS] {total} vecinos guardados para {matrix.shape[0]} libros ({matrix.nnz} filas de estantería)."
+    )
+    return total
+
+
+def neighbor_recommendations(user_books, selected_categories=None, exclude_ids=None, limit=20):
+    book_ids = [b.id for b in user_books]
+    if not book_ids:
+        return []
+    exclude_ids = set(exclude_ids or ()) | {b.google_id for b in user_books}
+
+    score = func.sum(BookNeighbor.score).label("score")
+    rows = (
+        db.session.query(Book, score)
+        .join(BookNeighbor, BookNeighbor.neighbor_id == Book.id)
+        .filter(BookNeighbor.book_id.in_(book_ids), ~BookNeighbor.neighbor_id.in_(book_ids))
+        .group_by(Book.id)
+        .order_by(score.desc())
+        .options(selectinload(Book.indexed_authors), selectinload(Book.indexed_categories))
+        .limit(limit * 3)
+        .all()
+    )
+    if not rows:
+        return []
+
+    top_score = float(rows[0][1]) or 1.0
+    results = []
+    for book, total in rows:
+        if book.google_id in exclude_ids:
+            continue
+        raw_categories = book.categories_list
+        mapped = [map_to_main_category(cat) for cat in normalize_categories(raw_categories)]
+        if selected_categories and not any(cat in selected_categories for cat in mapped):
+            continue
+        results.append({
+            "google_id": book.google_id,
+            "id": book.google_id,
+            "title": book.title,
+            "author": book.authors or "",
+            "authors": book.authors_list,
+            "language": book.language,
+            "thumbnail": book.thumbnail,
+            "categories": raw_categories,
+            "description": book.description or "",
+            "publisher": book.publisher or "No disponible",
+            "publishedDate": book.published_date or "",
+            "isbn": book.isbn,
+            "similarity": round(float(total) / top_score, 3),
+            "matched_category": mapped[0] if mapped else "",
+            "matched_terms": [cat for cat in mapped if cat in (selected_categories or [])],
+            "source": "cooccurrence",
+        })
+        if len(results) >= limit:
+            break
+    return results
+
+
+def blend_recommendations(content_results, neighbor_results, every=3):
+    # Interleaves one co-occurrence pick after every (every - 1) content-based
+    # results, skipping duplicates, and appends whatever is left of either list.
+    blended, seen = [], set()
+    content, neighbors = iter(content_results), iter(neighbor_results)
+    while True:
+        progressed = False
+        for source in [content] * (every - 1) + [neighbors]:
+            for item in source:
+                if item["google_id"] not in seen:
+                    seen.add(item["google_id"])
+                    blended.append(item)
+                    progressed = True
+                    break
+        if not progressed:
+            return blended
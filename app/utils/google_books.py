@@ -0,0 +1,343 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app.extensions import redis_client
+from app.utils.api_guard import (
+    ApiUnavailable,
+    acquire_token,
+    breaker_allow,
+    breaker_failure,
+    breaker_release_probe,
+    breaker_success,
+    queue_wait,
+    time_left,
+)
+from app.utils.singleflight import single_flight
+
+API_URL = "https://www.googleapis.com/books/v1/volumes"
+
+# Seconds per endpoint; subject queries are larger pages and get a bit more room.
+TIMEOUTS = {
+    "volume": 5,
+    "search": 5,
+    "isbn": 5,
+    "subject": 6,
+}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GoogleBooksError(Exception):
+    # Raised when the API could not be reached at all (after retries).
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class GoogleBooksHTTPError(GoogleBooksError):
+    # Raised when the API answered with a non-200 status.
+    pass
+
+
+class GoogleBooksUnavailable(GoogleBooksError):
+    # Raised without calling the API: the circuit is open or we are out of quota.
+    pass
+
+
+@dataclass
+class Volume:
+    google_id: str
+    title: str = ""
+    authors: list = field(default_factory=list)
+    language: str = ""
+    categories: list = field(default_factory=list)
+    description: str = ""
+    publisher: str = ""
+    published_date: str = ""
+    thumbnail: str = None
+    small_thumbnail: str = None
+    isbn_13: str = None
+    isbn_10: str = None
+
+    @property
+    def isbn(self):
+        return self.isbn_13 or self.isbn_10
+
+    @classmethod
+    def from_item(cls, item):
+        volume = item.get("volumeInfo", {}) or {}
+        identifiers = {
+            i.get("type"): i.get("identifier", "").replace("-", "").strip()
+            for i in volume.get("industryIdentifiers", [])
+        }
+        image_links = volume.get("imageLinks", {}) or {}
+        publisher = volume.get("publisher")
+        description = volume.get("description")
+        return cls(
+            google_id=(item.get("id") or "").strip(),
+            title=(volume.get("title") or "").strip(),
+            authors=volume.get("authors", []) or [],
+            language=volume.get("language", "") or "",
+            categories=volume.get("categories", []) or [],
+            description=description if isinstance(description, str) else "",
+            publisher=publisher.strip() if isinstance(publisher, str) else "",
+            published_date=volume.get("publishedDate", "") or "",
+            thumbnail=image_links.get("thumbnail"),
+            small_thumbnail=image_links.get("smallThumbnail"),
+            isbn_13=identifiers.get("ISBN_13") or None,
+            isbn_10=identifiers.get("ISBN_10") or None,
+        )
+
+    def to_dict(self):
+        return asdict(self)
+
+    def to_summary(self):
+        # The shape cached for book detail pages.
+        return {
+            "google_id": self.google_id,
+            "title": self.title,
+            "authors": self.authors,
+            "language": self.language,
+            "thumbnail": self.thumbnail,
+            "description": self.description,
+            "publisher": self.publisher,
+            "publishedDate": self.published_date,
+            "categories": self.categories,
+            "isbn": self.isbn,
+        }
+
+
+# Call statistics shared by every worker: one Redis hash per day with a
+# "{endpoint}:{status}" counter and an "{endpoint}:ms" latency total, read by
+# `flask gbooks stats`. volume_listeners receive the list of Volumes parsed
+# from every successful response.
+STATS_KEY = "gbooks:stats"
+STATS_TTL = 8 * 86400
+volume_listeners = []
+
+
+def stats_key(day=None):
+    return f"{STATS_KEY}:{(day or datetime.utcnow()):%Y%m%d}"
+
+
+def record_call(endpoint, status, elapsed):
+    key = stats_key()
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hincrby(key, f"{endpoint}:{status}", 1)
+        pipe.hincrbyfloat(key, f"{endpoint}:ms", elapsed * 1000)
+        pipe.expire(key, STATS_TTL)
+        pipe.execute()
+    except RedisError:
+        pass
+
+
+def publish_volumes(volumes):
+    if volumes:
+        for listener in volume_listeners:
+            listener(volumes)
+
+
+def stats(day=None):
+    # {endpoint: {"calls", "errors", "avg_ms", "statuses"}} for one UTC day.
+    entries = {}
+    for field_name, value in redis_client.hgetall(stats_key(day)).items():
+        endpoint, _, status = field_name.decode("utf-8").rpartition(":")
+        entry = entries.setdefault(endpoint, {"calls": 0, "errors": 0, "total_ms": 0.0, "statuses": {}})
+        if status == "ms":
+            entry["total_ms"] = float(value)
+            continue
+        entry["statuses"][status] = int(value)
+        entry["calls"] += int(value)
+        if status != "200":
+            entry["errors"] += int(value)
+    for entry in entries.values():
+        entry["avg_ms"] = entry["total_ms"] / entry["calls"] if entry["calls"] else 0.0
+    return entries
+
+
+# One keep-alive session per process; recreated after a fork so gunicorn
+# workers never share sockets with the master.
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                pool_size = current_app.config.get("GOOGLE_BOOKS_POOL_SIZE", 10)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def _get(endpoint, url, params):
+    config = current_app.config
+    params = dict(params, key=config.get("GOOGLE_BOOKS_API_KEY"))
+    retries = config.get("GOOGLE_BOOKS_MAX_RETRIES", 2)
+    backoff = config.get("GOOGLE_BOOKS_BACKOFF", 0.3)
+    timeout = TIMEOUTS.get(endpoint, 5)
+    session = get_session()
+
+    # The breaker is checked once per call, so a half-open probe keeps its
+    # retries, and it counts one failure per call, however many attempts it took.
+    try:
+        probe = breaker_allow()
+    except ApiUnavailable as e:
+        record_call(endpoint, "skipped", 0.0)
+        raise GoogleBooksUnavailable(f"Google Books {endpoint}: {e}") from None
+
+    # A probe that ends without an outcome (no token, or the deadline passed
+    # before any attempt) hands the probe back instead of holding it for the
+    # whole cooldown.
+    reported = False
+    try:
+        status, error = None, None
+        for attempt in range(retries + 1):
+            # Inside a call deadline (a request fanning out subject queries) no
+            # attempt is started once it has passed.
+            remaining = time_left()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                acquire_token()
+            except ApiUnavailable as e:
+                record_call(endpoint, "skipped", 0.0)
+                if error is not None or status in RETRY_STATUSES:
+                    # The attempts made so far failed; the call still counts once.
+                    breaker_failure()
+                    reported = True
+                raise GoogleBooksUnavailable(f"Google Books {endpoint}: {e}") from None
+
+            started = time.monotonic()
+            try:
+                response = session.get(url, params=params, timeout=timeout)
+                status, error = response.status_code, None
+            except requests.RequestException as e:
+                response, status, error = None, None, e
+            elapsed = time.monotonic() - started
+            record_call(endpoint, status, elapsed)
+            current_app.logger.debug(f"[GBOOKS] {endpoint} {status} {elapsed * 1000:.0f}ms (intento {attempt + 1})")
+
+            failed = status is None or status in RETRY_STATUSES
+            if not failed:
+                breaker_success()
+                reported = True
+
+            if status == 200:
+                return response.json()
+            if not failed:
+                break
+            if attempt < retries:
+                # Exponential backoff with full jitter so workers don't retry in lockstep.
+                pause = random.uniform(0, backoff * (2 ** attempt))
+                remaining = time_left()
+                if remaining is not None and pause + timeout > remaining:
+                    break
+                time.sleep(pause)
+
+        if error is not None or status in RETRY_STATUSES:
+            breaker_failure()
+            reported = True
+        if status is None:
+            raise GoogleBooksError(f"Google Books {endpoint}: {error or 'plazo agotado'}")
+        raise GoogleBooksHTTPError(f"Google Books {endpoint}: HTTP {status}", status=status)
+    finally:
+        if probe and not reported:
+            breaker_release_probe()
+
+
+def call_budget(endpoint):
+    # Worst-case seconds for one _get: every attempt's timeout and token wait,
+    # plus the backoff between attempts. Followers of a coalesced call wait
+    # this long before calling the API themselves.
+    config = current_app.config
+    retries = config.get("GOOGLE_BOOKS_MAX_RETRIES", 2)
+    backoff = config.get("GOOGLE_BOOKS_BACKOFF", 0.3)
+    queue = config.get("GOOGLE_BOOKS_MAX_QUEUE_WAIT", 0.5)
+    return (TIMEOUTS.get(endpoint, 5) + queue) * (retries + 1) + backoff * (2 ** retries - 1)
+
+
+# Identical lookups in flight on any worker are coalesced into one API call.
+def get_volume(google_id):
+    def fetch():
+        data = _get("volume", f"{API_URL}/{google_id}", {})
+        if not data.get("volumeInfo"):
+            return None
+        volume = Volume.from_item(data)
+        publish_volumes([volume])
+        return volume
+    return single_flight(f"volume:{google_id}", fetch, wait=call_budget("volume"))
+
+
+def search_volumes(q, max_results=10, start_index=0, order_by=None, lang=None, print_type=None, endpoint="search"):
+    params = {"q": q, "maxResults": max_results}
+    if start_index:
+        params["startIndex"] = start_index
+    if order_by:
+        params["orderBy"] = order_by
+    if lang:
+        params["langRestrict"] = lang
+    if print_type:
+        params["printType"] = print_type
+
+    def fetch():
+        data = _get(endpoint, API_URL, params)
+        volumes = [Volume.from_item(item) for item in data.get("items", []) or []]
+        publish_volumes(volumes)
+        return volumes
+
+    if endpoint == "subject":
+        return fetch()
+    flight_key = f"{endpoint}:" + "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+    return single_flight(flight_key, fetch, wait=call_budget(endpoint))
+
+
+def find_volume_by_isbn(isbn):
+    volumes = search_volumes(f"isbn:{isbn}", max_results=1, endpoint="isbn")
+    return volumes[0] if volumes else None
+
+
+def fetch_concurrently(fn, items, workers=4, max_wait=None):
+    # Calls fn(item) for every item on up to `workers` threads, each inside the
+    # app context, and returns {item: result}. Failed calls are left out, and
+    # once the API reports it is unavailable the remaining calls are skipped.
+    # max_wait overrides how long each call may queue for a rate-limit token.
+    app = current_app._get_current_object()
+    unavailable = threading.Event()
+    skipped = object()
+
+    def call(item):
+        if unavailable.is_set():
+            return skipped
+        with app.app_context(), queue_wait(max_wait):
+            try:
+                return fn(item)
+            except GoogleBooksUnavailable as e:
+                if not unavailable.is_set():
+                    unavailable.set()
+                    app.logger.warning(f"[GBOOKS] Consultas en lote detenidas: {e}")
+                return skipped
+            except GoogleBooksError:
+                return skipped
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gbooks-batch") as pool:
+        for item, result in zip(items, pool.map(call, items)):
+            if result is not skipped:
+                results[item] = result
+    return results
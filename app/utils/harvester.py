@@ -0,0 +1,141 @@
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_
+
+from app.extensions import db
+from app.models import CandidateVolume, CandidateCategory, HarvestState
+from app.utils.books import truncate
+from app.utils.categories import CATEGORY_GROUPS
+from app.utils.jobs import job
+from app.utils.recommend_engine import RECOMMEND_LANGUAGES, fetch_subject_items, parse_volume_candidate
+from app.utils.tfidf_model import get_shared_vectorizer, encode_vector
+
+HARVEST_PAGE_SIZE = 40
+
+
+def harvest_subjects():
+    for subjects in CATEGORY_GROUPS.values():
+        for subject in subjects:
+            for lang in RECOMMEND_LANGUAGES:
+                yield lang, subject
+
+
+def store_candidates(volumes):
+    parsed = {}
+    for volume in volumes:
+        candidate = parse_volume_candidate(volume)
+        if candidate and candidate[0]["google_id"]:
+            parsed[candidate[0]["google_id"]] = candidate
+    if not parsed:
+        return 0
+
+    existing = {
+        row.google_id: row
+        for row in CandidateVolume.query.filter(CandidateVolume.google_id.in_(list(parsed)))
+    }
+    for gid, (candidate, mapped_categories, document, dedupe_key) in parsed.items():
+        row = existing.get(gid)
+        if row is None:
+            row = CandidateVolume(google_id=gid)
+            db.session.add(row)
+
+        row.language = candidate["language"]
+        row.title = truncate(candidate["title"], 255)
+        row.authors = candidate["authors"]
+        row.categories = candidate["categories"]
+        row.publisher = truncate(candidate["publisher"], 255)
+        row.published_date = truncate(candidate["publishedDate"], 20)
+        row.thumbnail = truncate(candidate["thumbnail"], 512)
+        row.isbn = truncate(candidate["isbn"], 20)
+        row.description = candidate["description"]
+        row.dedupe_key = truncate(dedupe_key, 255)
+        row.harvested_at = datetime.utcnow()
+        if row.document != document:
+            row.document = document
+            row.vector = None
+            row.model_version = None
+
+        wanted = {cat for cat in mapped_categories if cat in CATEGORY_GROUPS}
+        current = {link.main_category for link in row.main_categories}
+        for link in list(row.main_categories):
+            if link.main_category not in wanted:
+                row.main_categories.remove(link)
+        for cat in wanted - current:
+            row.main_categories.append(CandidateCategory(main_category=cat))
+    return len(parsed)
+
+
+def vectorize_candidates(batch_size=500):
+    # Projects every candidate not yet in the current model's space.
+    vectorizer, model_version = get_shared_vectorizer()
+    if vectorizer is None:
+        return 0
+
+    total = 0
+    while True:
+        rows = (
+            CandidateVolume.query
+            .filter(or_(CandidateVolume.model_version.is_(None), CandidateVolume.model_version != model_version))
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        matrix = vectorizer.transform([row.document for row in rows]).tocsr()
+        for i, row in enumerate(rows):
+            row.vector = encode_vector(matrix[i])
+            row.model_version = model_version
+        db.session.commit()
+        total += len(rows)
+
+    current_app.logger.info(f"[HARVEST] {total} candidatos vectorizados con el modelo {model_version}.")
+    return total
+
+
+@job("catalog.harvest", every_hours="HARVEST_INTERVAL_HOURS")
+def harvest_catalog(pages_per_subject=None):
+    # Walks every (language, subject) a few pages at a time. Progress is
+    # committed after each page, so an interrupted run resumes where it stopped;
+    # a subject that was walked to the end is revisited after HARVEST_REFRESH_DAYS.
+    config = current_app.config
+    pages_per_subject = pages_per_subject or config.get("HARVEST_PAGES_PER_SUBJECT", 2)
+    delay = config.get("HARVEST_REQUEST_DELAY", 1.0)
+    max_index = config.get("HARVEST_MAX_INDEX", 400)
+    refresh_after = timedelta(days=config.get("HARVEST_REFRESH_DAYS", 7))
+
+    calls = stored = 0
+    for lang, subject in harvest_subjects():
+        state = db.session.get(HarvestState, (lang, subject))
+        if state is None:
+            state = HarvestState(language=lang, subject=subject, next_index=0, exhausted=False)
+            db.session.add(state)
+
+        if state.exhausted:
+            if state.last_run_at and datetime.utcnow() - state.last_run_at < refresh_after:
+                continue
+            state.next_index = 0
+            state.exhausted = False
+
+        for _ in range(pages_per_subject):
+            if calls:
+                time.sleep(delay)
+            items = fetch_subject_items(lang, subject, HARVEST_PAGE_SIZE, start_index=state.next_index)
+            calls += 1
+            if items is None:
+                current_app.logger.warning(f"[HARVEST] Falló {lang}/{subject} en {state.next_index}; se reintentará.")
+                break
+
+            stored += store_candidates(items)
+            state.next_index += len(items)
+            state.last_run_at = datetime.utcnow()
+            state.exhausted = len(items) < HARVEST_PAGE_SIZE or state.next_index >= max_index
+            db.session.commit()
+            if state.exhausted:
+                break
+        db.session.commit()
+
+    current_app.logger.info(f"[HARVEST] {calls} consultas, {stored} candidatos guardados.")
+    vectorize_candidates()
+    return stored
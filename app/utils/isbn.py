@@ -0,0 +1,167 @@
+import re
+from datetime import datetime, timedelta
+
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.extensions import db, redis_client
+from app.models import Book, IsbnLookup, StoredVolume
+from app.utils.google_books import (
+    GoogleBooksError,
+    GoogleBooksUnavailable,
+    fetch_concurrently,
+    find_volume_by_isbn,
+    volume_listeners,
+)
+
+ISBN_POSITIVE_TTL = 30 * 86400
+
+
+def normalize_isbn(raw):
+    isbn = re.sub(r"[^0-9Xx]", "", raw or "").upper()
+    return isbn if len(isbn) in (10, 13) else None
+
+
+def isbn_key(isbn):
+    return f"isbn:{isbn}"
+
+
+def negative_ttl():
+    return current_app.config.get("ISBN_NEGATIVE_TTL", 3600)
+
+
+def cache_isbn_mappings(mappings):
+    # mappings: {isbn: google_id or None}; None entries are negative and short-lived.
+    if not mappings:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for isbn, google_id in mappings.items():
+            pipe.set(isbn_key(isbn), google_id or "", ex=ISBN_POSITIVE_TTL if google_id else negative_ttl())
+        pipe.execute()
+    except RedisError as e:
+        current_app.logger.warning(f"[ISBN] No se pudo guardar el mapeo en Redis: {e}")
+
+
+def remember_volume_isbns(volumes):
+    # Registered as a Google Books volume listener: every API response, not
+    # only ISBN lookups, teaches us ISBN -> google_id pairs for free.
+    cache_isbn_mappings({
+        isbn: v.google_id
+        for v in volumes if v.google_id
+        for isbn in (v.isbn_13, v.isbn_10) if normalize_isbn(isbn)
+    })
+
+
+volume_listeners.append(remember_volume_isbns)
+
+
+def _lookup_local(isbns):
+    found = dict(db.session.query(Book.isbn, Book.google_id).filter(Book.isbn.in_(isbns)))
+    pending = [i for i in isbns if i not in found]
+    if pending:
+        found.update(
+            db.session.query(StoredVolume.isbn, StoredVolume.google_id)
+            .filter(StoredVolume.isbn.in_(pending), StoredVolume.found.is_(True))
+        )
+    return found
+
+
+def _lookup_cached(isbns):
+    results = {}
+    try:
+        values = redis_client.mget([isbn_key(i) for i in isbns])
+    except RedisError:
+        values = [None] * len(isbns)
+    for isbn, value in zip(isbns, values):
+        if value is not None:
+            results[isbn] = value.decode() or None
+
+    pending = [i for i in isbns if i not in results]
+    if pending:
+        negative_since = datetime.utcnow() - timedelta(seconds=negative_ttl())
+        learned = {}
+        for row in IsbnLookup.query.filter(IsbnLookup.isbn.in_(pending)):
+            if row.google_id or row.checked_at >= negative_since:
+                learned[row.isbn] = row.google_id
+        cache_isbn_mappings(learned)
+        results.update(learned)
+    return results
+
+
+def _save_lookups(mappings):
+    # Upserts in their own transaction, like store_volumes: a concurrent lookup
+    # of the same ISBN can't fail and the caller's session is left alone.
+    if not mappings:
+        return
+    now = datetime.utcnow()
+    rows = [{"isbn": isbn, "google_id": google_id, "checked_at": now} for isbn, google_id in mappings.items()]
+    table = IsbnLookup.__table__
+    if db.engine.dialect.name == "mysql":
+        stmt = mysql_insert(table)
+        stmt = stmt.on_duplicate_key_update(google_id=stmt.inserted.google_id, checked_at=stmt.inserted.checked_at)
+    else:
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["isbn"],
+            set_={"google_id": stmt.excluded.google_id, "checked_at": stmt.excluded.checked_at},
+        )
+    with db.engine.begin() as conn:
+        conn.execute(stmt, rows)
+
+
+def _lookup_api(isbns, strict):
+    found = {}
+    for isbn in isbns:
+        try:
+            found[isbn] = find_volume_by_isbn(isbn)
+        except GoogleBooksUnavailable as e:
+            if strict:
+                raise
+            current_app.logger.warning(f"[ISBN] {len(isbns) - len(found)} ISBN sin resolver: {e}")
+            break
+        except GoogleBooksError:
+            if strict:
+                raise
+    return found
+
+
+def resolve_isbns(isbns, strict=False, workers=1, max_wait=None):
+    # Resolves many ISBNs at once: local books and stored volumes, then the
+    # Redis/DB mapping (negative answers included), and only then one API
+    # lookup per ISBN still unknown. Returns {isbn: google_id or None} keyed by
+    # normalized ISBN; invalid ISBNs are skipped. ISBNs left unresolved because
+    # the API failed map to None but are not remembered as missing; with
+    # strict=True the GoogleBooksError is raised instead. With workers > 1 the
+    # API lookups run concurrently (still under the shared rate limit).
+    pending = list(dict.fromkeys(i for i in map(normalize_isbn, isbns) if i))
+    results = {}
+    for tier in (_lookup_local, _lookup_cached):
+        if pending:
+            results.update(tier(pending))
+            pending = [i for i in pending if i not in results]
+
+    if workers > 1 and not strict:
+        found = fetch_concurrently(find_volume_by_isbn, pending, workers, max_wait)
+    else:
+        found = _lookup_api(pending, strict)
+
+    learned = {isbn: volume.google_id if volume else None for isbn, volume in found.items()}
+    if learned:
+        _save_lookups(learned)
+        cache_isbn_mappings(learned)
+        results.update(learned)
+
+    for isbn in pending:
+        results.setdefault(isbn, None)
+    return results
+
+
+def google_id_for_isbn(isbn):
+    # Single-ISBN form; raises GoogleBooksError if the API had to be asked and failed.
+    isbn = normalize_isbn(isbn)
+    if not isbn:
+        return None
+    return resolve_isbns([isbn], strict=True).get(isbn)
@@ -0,0 +1,113 @@
+import json
+import signal
+import time
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app.extensions import db, redis_client
+
+QUEUE_KEY = "smartstack:jobs"
+PENDING_KEY = "smartstack:jobs:pending"
+FAILED_KEY = "smartstack:jobs:failed"
+SCHEDULE_KEY = "smartstack:jobs:schedule"
+
+_handlers = {}
+# Periodic jobs: name -> config key holding the interval in hours.
+_schedules = {}
+
+# Marks the payload pending and pushes it in one atomic step, so a payload can
+# never be left in PENDING_KEY without a queue entry (which would drop every
+# later enqueue of the same job).
+_ENQUEUE_SCRIPT = """
+if redis.call('SADD', KEYS[1], ARGV[1]) == 1 then
+  redis.call('LPUSH', KEYS[2], ARGV[1])
+  return 1
+end
+return 0
+"""
+
+_enqueue_once = redis_client.register_script(_ENQUEUE_SCRIPT)
+
+
+def job(name, every_hours=None):
+    # every_hours names a config key; when set, workers enqueue the job (with
+    # no arguments) once per that many hours.
+    def decorator(fn):
+        _handlers[name] = fn
+        if every_hours:
+            _schedules[name] = every_hours
+        return fn
+    return decorator
+
+
+def enqueue_due_jobs():
+    # The NX key expires after the interval, so across all workers each
+    # periodic job is enqueued at most once per interval.
+    for name, config_key in _schedules.items():
+        hours = current_app.config.get(config_key)
+        if not hours:
+            continue
+        try:
+            if redis_client.set(f"{SCHEDULE_KEY}:{name}", int(time.time()), nx=True, ex=int(hours * 3600)):
+                enqueue(name)
+        except RedisError as e:
+            current_app.logger.warning(f"[JOBS] No se pudo programar {name}: {e}")
+
+
+def enqueue(name, **kwargs):
+    # Identical payloads already waiting in the queue are collapsed into one job,
+    # so a burst of toggles on the same library triggers a single recompute.
+    payload = json.dumps({"job": name, "kwargs": kwargs}, sort_keys=True)
+    try:
+        _enqueue_once(keys=[PENDING_KEY, QUEUE_KEY], args=[payload])
+        return True
+    except RedisError as e:
+        current_app.logger.warning(f"[JOBS] No se pudo encolar {name}: {e}")
+        return False
+
+
+def run_job(payload):
+    data = json.loads(payload)
+    handler = _handlers.get(data["job"])
+    if handler is None:
+        current_app.logger.error(f"[JOBS] Trabajo desconocido: {data['job']}")
+        return
+
+    started = time.monotonic()
+    try:
+        handler(**data.get("kwargs", {}))
+        current_app.logger.info(f"[JOBS] {data['job']} completado en {time.monotonic() - started:.2f}s")
+    except Exception:
+        db.session.rollback()
+        redis_client.lpush(FAILED_KEY, payload)
+        current_app.logger.exception(f"[JOBS] {data['job']} falló: {payload}")
+    finally:
+        db.session.remove()
+
+
+def run_worker(poll_timeout=5):
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    current_app.logger.info(f"[JOBS] Worker escuchando {QUEUE_KEY} ({len(_handlers)} tipos de trabajo).")
+    while not stopping:
+        enqueue_due_jobs()
+        try:
+            popped = redis_client.brpop(QUEUE_KEY, timeout=poll_timeout)
+        except RedisError as e:
+            current_app.logger.error(f"[JOBS] Error de Redis: {e}")
+            time.sleep(poll_timeout)
+            continue
+        if not popped:
+            continue
+        _, payload = popped
+        redis_client.srem(PENDING_KEY, payload)
+        run_job(payload)
+    current_app.logger.info("[JOBS] Worker detenido.")
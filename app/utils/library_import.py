@@ -0,0 +1,243 @@
+import csv
+import os
+import uuid
+from datetime import datetime
+from itertools import islice
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app.extensions import db, redis_client
+from app.models import Book, LibraryBook, StoredVolume, UserLibrary, WishlistBook, Wishlist
+from app.utils.api_guard import quota_exhausted
+from app.utils.book_index import insert_ignore
+from app.utils.books import ensure_books
+from app.utils.google_books import fetch_concurrently, get_volume, search_volumes
+from app.utils.isbn import normalize_isbn, resolve_isbns
+from app.utils.jobs import job, enqueue
+from app.utils.recommend_engine import record_library_import
+from app.utils.shelves import add_to_shelf, remove_from_shelf
+from app.utils.volume_store import to_volume
+
+IMPORT_BATCH = 100
+PROGRESS_TIMEOUT = 86400
+IMPORT_FAILED_MESSAGE = "No se pudo completar la importación. Intenta más tarde."
+
+# Header names (lowercased) accepted for each field; covers Goodreads and
+# StoryGraph exports as well as a plain isbn,title,author CSV.
+COLUMNS = {
+    "isbn": ("isbn13", "isbn", "isbn/uid"),
+    "title": ("title",),
+    "author": ("author", "authors", "author l-f"),
+}
+
+
+def progress_key(import_id):
+    return f"library_import:{import_id}"
+
+
+def upload_dir():
+    return current_app.config.get("IMPORT_UPLOAD_DIR", "uploads")
+
+
+def start_import(user_id, upload):
+    # Streams the uploaded file to the shared upload directory (werkzeug copies
+    # it in chunks) and queues the job; returns the import id used for polling.
+    import_id = uuid.uuid4().hex
+    os.makedirs(upload_dir(), exist_ok=True)
+    path = os.path.join(upload_dir(), f"{import_id}.csv")
+    upload.save(path)
+
+    try:
+        redis_client.hset(progress_key(import_id), mapping={
+            "user_id": user_id,
+            "status": "queued",
+            "rows": 0,
+            "added": 0,
+            "already": 0,
+            "not_found": 0,
+            "skipped": 0,
+        })
+        redis_client.expire(progress_key(import_id), PROGRESS_TIMEOUT)
+    except RedisError as e:
+        current_app.logger.warning(f"[IMPORT] No se pudo registrar la importación de {user_id}: {e}")
+        os.remove(path)
+        return None
+    if not enqueue("library.import", user_id=user_id, import_id=import_id, path=path):
+        os.remove(path)
+        try:
+            redis_client.delete(progress_key(import_id))
+        except RedisError:
+            pass
+        return None
+    return import_id
+
+
+def import_progress(import_id, user_id):
+    data = redis_client.hgetall(progress_key(import_id))
+    if not data:
+        return None
+    progress = {k.decode("utf-8"): v.decode("utf-8") for k, v in data.items()}
+    if progress.get("user_id") != str(user_id):
+        return None
+    for field in ("rows", "added", "already", "not_found", "skipped"):
+        progress[field] = int(progress.get(field, 0))
+    return progress
+
+
+def _update_progress(import_id, status=None, **counts):
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for field, amount in counts.items():
+            if amount:
+                pipe.hincrby(progress_key(import_id), field, amount)
+        if status:
+            pipe.hset(progress_key(import_id), "status", status)
+        pipe.expire(progress_key(import_id), PROGRESS_TIMEOUT)
+        pipe.execute()
+    except RedisError as e:
+        current_app.logger.warning(f"[IMPORT] No se pudo actualizar el progreso de {import_id}: {e}")
+
+
+def parse_row(row):
+    # Returns (isbn, title, author) from a CSV row; Goodreads wraps ISBNs as ="978...".
+    fields = {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+
+    def first(name):
+        return next((fields[col] for col in COLUMNS[name] if fields.get(col)), "")
+
+    isbn = None
+    for col in COLUMNS["isbn"]:
+        isbn = normalize_isbn(fields.get(col))
+        if isbn:
+            break
+    return isbn, first("title"), first("author")
+
+
+def iter_rows(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            yield parse_row(row)
+
+
+def search_by_title(title_author):
+    title, author = title_author
+    q = f'intitle:"{title}"' + (f' inauthor:"{author}"' if author else "")
+    volumes = search_volumes(q, max_results=1)
+    return volumes[0] if volumes else None
+
+
+def resolve_rows(rows, workers, max_wait):
+    # Returns one google_id (or None) per row: ISBNs through the shared
+    # resolver, everything else by a title/author search.
+    isbn_ids = resolve_isbns([isbn for isbn, _, _ in rows if isbn], workers=workers, max_wait=max_wait)
+    by_title = list(dict.fromkeys(
+        (title, author) for isbn, title, author in rows
+        if title and not isbn_ids.get(isbn)
+    ))
+    found = fetch_concurrently(search_by_title, by_title, workers, max_wait)
+    google_ids = []
+    for isbn, title, author in rows:
+        google_id = isbn_ids.get(isbn)
+        if not google_id and found.get((title, author)):
+            google_id = found[(title, author)].google_id
+        google_ids.append(google_id)
+    return google_ids
+
+
+def load_volumes_for(google_ids, workers, max_wait):
+    volumes = {
+        row.google_id: to_volume(row)
+        for row in StoredVolume.query.filter(StoredVolume.google_id.in_(google_ids), StoredVolume.found.is_(True))
+    }
+    missing = [gid for gid in google_ids if gid not in volumes]
+    fetched = fetch_concurrently(get_volume, missing, workers, max_wait)
+    volumes.update((gid, v) for gid, v in fetched.items() if v)
+    return list(volumes.values())
+
+
+@job("library.import")
+def import_library(user_id, import_id, path):
+    # Streams the CSV in batches of IMPORT_BATCH rows: resolve the batch
+    # concurrently, create the missing books in one INSERT, then add the new
+    # library_books rows in another. Memory stays flat regardless of file size.
+    # Stops with status "quota" once the daily API quota is spent; importing
+    # the same file again later picks up the remaining rows.
+    config = current_app.config
+    workers = config.get("IMPORT_WORKERS", 4)
+    max_wait = config.get("IMPORT_QUEUE_WAIT", 30)
+
+    _update_progress(import_id, status="running")
+    try:
+        library = UserLibrary.query.filter_by(user_id=user_id).first()
+        if library is None:
+            library = UserLibrary(user_id=user_id)
+            db.session.add(library)
+            db.session.commit()
+        wishlist = Wishlist.query.filter_by(user_id=user_id).first()
+        shelved = {book_id for (book_id,) in db.session.query(LibraryBook.book_id).filter_by(library_id=library.id)}
+
+        rows_iter = iter_rows(path)
+        added_total, status = 0, "done"
+        while True:
+            rows = list(islice(rows_iter, IMPORT_BATCH))
+            if not rows:
+                break
+
+            google_ids = resolve_rows(rows, workers, max_wait)
+            wanted = [gid for gid in dict.fromkeys(google_ids) if gid]
+            book_ids = dict(db.session.query(Book.google_id, Book.id).filter(Book.google_id.in_(wanted)))
+            missing = [gid for gid in wanted if gid not in book_ids]
+            if missing:
+                book_ids.update(ensure_books(load_volumes_for(missing, workers, max_wait)))
+
+            new_gids = [gid for gid in wanted if gid in book_ids and book_ids[gid] not in shelved]
+            new_ids = [book_ids[gid] for gid in new_gids]
+            if new_ids:
+                # Rows the user added meanwhile by hand are skipped, not an error.
+                now = datetime.utcnow()
+                insert_ignore(LibraryBook, [
+                    {"library_id": library.id, "book_id": book_id, "added_at": now} for book_id in new_ids
+                ])
+                if wishlist is not None:
+                    WishlistBook.query.filter(
+                        WishlistBook.wishlist_id == wishlist.id, WishlistBook.book_id.in_(new_ids)
+                    ).delete(synchronize_session=False)
+                db.session.commit()
+                add_to_shelf(user_id, "library", *new_gids)
+                remove_from_shelf(user_id, "wishlist", *new_gids)
+                shelved.update(new_ids)
+                added_total += len(new_ids)
+
+            resolved = sum(1 for gid in google_ids if gid)
+            _update_progress(
+                import_id,
+                rows=len(rows),
+                added=len(new_ids),
+                already=sum(1 for gid in wanted if gid in book_ids) - len(new_ids),
+                not_found=len(rows) - resolved,
+                skipped=sum(1 for gid in wanted if gid not in book_ids),
+            )
+            if quota_exhausted():
+                status = "quota"
+                current_app.logger.warning(f"[IMPORT] Cuota diaria agotada; importación {import_id} detenida.")
+                break
+
+        if added_total:
+            record_library_import(user_id)
+            enqueue("recommendations.precompute", user_id=user_id)
+        _update_progress(import_id, status=status)
+        current_app.logger.info(f"[IMPORT] Usuario {user_id}: {added_total} libros importados ({import_id}).")
+        return added_total
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"[IMPORT] Importación {import_id} fallida: {e}")
+        # The exception text stays in the log; the page only gets a fixed message.
+        try:
+            redis_client.hset(progress_key(import_id), mapping={"status": "failed", "error": IMPORT_FAILED_MESSAGE})
+        except RedisError:
+            pass
+        raise
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
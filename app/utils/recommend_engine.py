@@ -1,105 +1,296 @@
-import requests
-import numpy as np
 import hashlib
+import json
+import numpy as np
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 from flask import current_app
-from collections import defaultdict
+from redis.exceptions import RedisError, WatchError
 from app.utils.books import clean_description, normalize_categories
+from app.utils.book_index import user_main_categories
+from app.utils.categories import CATEGORY_GROUPS, map_to_main_category
+from app.utils.tfidf_model import get_shared_vectorizer, decode_vectors
+from app.extensions import cache, db, redis_client
+from sqlalchemy.orm import selectinload
+from app.models import Book, LibraryBook, UserLibrary, CandidateVolume, CandidateCategory
+from app.utils.jobs import job
+from app.utils.api_guard import call_deadline
+from app.utils.google_books import GoogleBooksError, search_volumes
+from app.utils.swr_cache import refresh_in_background, stale_timeout, swr_set, unwrap
+from app.utils.cooccurrence import neighbor_recommendations, blend_recommendations
+
+RECOMMEND_LANGUAGES = ("es", "en")
+RECOMMENDATIONS_TIMEOUT = 172800  # 48h
+PROFILE_TIMEOUT = 30 * 86400
+PROFILE_ALL = "_all"
+
+# Shared per worker process, so concurrent requests can't open more than
+# RECOMMEND_FETCH_WORKERS outbound connections between them.
+_fetch_pool = None
+
+
+def get_fetch_pool():
+    global _fetch_pool
+    if _fetch_pool is None:
+        _fetch_pool = ThreadPoolExecutor(
+            max_workers=current_app.config.get("RECOMMEND_FETCH_WORKERS", 8),
+            thread_name_prefix="recommend-fetch",
+        )
+    return _fetch_pool
 
-CATEGORY_GROUPS = {
-    "Ficción": ["Fiction", "Literary Fiction", "Contemporary Fiction", "Short Stories"],
-    "Romance": ["Romance", "Historical Romance", "Paranormal Romance", "Chick Lit"],
-    "Misterio y Suspenso": ["Mystery", "Thriller", "Crime", "Suspense", "Detective"],
-    "Ciencia ficción": ["Science Fiction", "Dystopian", "Space Opera", "Cyberpunk"],
-    "Fantasía": ["Fantasy", "Epic Fantasy", "Urban Fantasy", "Dark Fantasy"],
-    "Terror": ["Horror", "Supernatural", "Gothic", "Occult"],
-    "Biografía y Memorias": ["Biography", "Memoir", "Autobiography", "Personal Memoirs"],
-    "Historia": ["History", "Military History", "World History", "Ancient Civilizations"],
-    "Autoayuda y Bienestar": ["Self-Help", "Motivation", "Mental Health", "Wellness", "Productivity"],
-    "Negocios y Economía": ["Business", "Economics", "Finance", "Leadership", "Entrepreneurship"],
-    "Ciencia y Tecnología": ["Science", "Technology", "Physics", "Biology", "AI", "Engineering"],
-    "Juvenil": ["Young Adult", "YA Romance", "YA Fantasy", "Coming of Age"],
-    "Poesía": ["Poetry", "Verse", "Anthology", "Contemporary Poetry"],
-    "Filosofía y Religión": ["Philosophy", "Religion", "Spirituality", "Theology", "Ethics"],
-    "Educación y Aprendizaje": ["Education", "Pedagogy", "Study Guides", "Teaching", "Academic Skills"],
-    "Familia y Relaciones": ["Parenting", "Relationships", "Family", "Marriage", "Dating"],
-    "Arte y Diseño": ["Art", "Design", "Photography", "Architecture", "Graphic Design"],
-    "Viajes y Aventura": ["Travel", "Adventure", "Travel Guides", "Exploration", "Cultural Travel"],
-    "Cocina y Gastronomía": ["Cooking", "Cookbooks", "Food", "Nutrition", "Culinary Arts"],
-    "Política y Sociedad": ["Politics", "Sociology", "Current Affairs", "Social Issues", "Civic Engagement"],
-    "Cómics y Novelas gráficas": ["Comics", "Graphic Novels", "Manga", "Webcomics"],
-    "Infantil": ["Children", "Picture Books", "Early Readers", "Middle Grade"]
-}
-
-
-def map_to_main_category(raw_category):
-    if not raw_category:
-        return "Other"
-    raw = raw_category.lower()
-    for main_cat, subcats in CATEGORY_GROUPS.items():
-        if any(sub.lower() in raw for sub in subcats):
-            return main_cat
-    return "Other"
-
-def group_books_by_category(user_books):
-    grouped = defaultdict(list)
-    for b in user_books:
-        if b.categories:
-            for raw_cat in normalize_categories(b.categories.split(",")):
-                main_cat = map_to_main_category(raw_cat)
-                grouped[main_cat].append(b)
-    return grouped
 
 def clean_text(text):
     return re.sub(r"[^\w\s]", "", text.strip().lower()) if text else ""
 
+def book_document(b, normalized_categories=None):
+    normalized = normalized_categories if normalized_categories is not None else normalize_categories((b.categories or "").split(","))
+    return " ".join([
+        clean_text(b.title),
+        clean_text(b.authors),
+        clean_text(",".join(normalized)),
+        clean_text(b.language),
+        clean_text(b.publisher),
+        clean_text(clean_description(b.description))
+    ])
+
+def profile_categories(b):
+    # Returns (normalized raw categories, mapped main categories), or None for
+    # books that never contribute to a profile.
+    if not (b.authors and b.categories and b.language):
+        return None
+    normalized = normalize_categories(b.categories.split(","))
+    return normalized, {map_to_main_category(cat) for cat in normalized}
+
 def build_user_profile(user_books, selected_categories=None):
     corpus = []
     for b in user_books:
-        if not (b.authors and b.categories and b.language):
+        categories = profile_categories(b)
+        if categories is None:
             continue
-        normalized = normalize_categories(b.categories.split(","))
+        normalized, mapped = categories
         if selected_categories:
-            if not any(map_to_main_category(cat) in selected_categories for cat in normalized):
+            if not any(cat in selected_categories for cat in mapped):
                 continue
-        enriched = " ".join([
-            clean_text(b.title),
-            clean_text(b.authors),
-            clean_text(",".join(normalized)),
-            clean_text(b.language),
-            clean_text(b.publisher),
-            clean_text(clean_description(b.description))
-        ])
-        corpus.append(enriched)
+        corpus.append(book_document(b, normalized))
 
     if not corpus:
-        return None, None, None
-
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(corpus)
+        return None, None
+
+    # Project into the shared corpus-wide space when a fitted model exists;
+    # otherwise fall back to a vectorizer fitted on this library alone.
+    vectorizer, _ = get_shared_vectorizer()
+    if vectorizer is not None:
+        tfidf_matrix = vectorizer.transform(corpus)
+    else:
+        vectorizer = TfidfVectorizer()
+        tfidf_matrix = vectorizer.fit_transform(corpus)
     profile_vector = np.asarray(tfidf_matrix.mean(axis=0)).flatten()
 
-    book_ids = [b.google_id for b in user_books if b.google_id]
-    hash_input = f"{len(corpus)}|" + "|".join(book_ids) + "|" + "|".join(corpus) + "|" + "|".join(selected_categories or [])
+    return profile_vector, vectorizer
+
+def score_matrix(profile_vector, matrix):
+    profile_norm = np.linalg.norm(profile_vector)
+    if not profile_norm:
+        return np.zeros(matrix.shape[0])
+    row_norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    dots = np.asarray(matrix @ profile_vector, dtype=np.float64).ravel()
+    return np.divide(dots, row_norms * profile_norm, out=np.zeros_like(dots), where=row_norms > 0)
+
+def select_top(scores, min_similarity=0.2, top_k=None):
+    keep = np.flatnonzero(scores >= min_similarity)
+    if top_k is not None and len(keep) > top_k:
+        keep = keep[np.argpartition(-scores[keep], top_k - 1)[:top_k]]
+    return keep[np.argsort(-scores[keep], kind="stable")]
+
+def score_candidates(profile_vector, vectorizer, candidates, min_similarity=0.2, top_k=None):
+    # candidates: list of (result_dict, document) pairs, already filtered and deduped.
+    # Returns the result dicts with "similarity" set, best first.
+    if not candidates:
+        return []
 
-    profile_hash = hashlib.md5(hash_input.encode("utf-8")).hexdigest()
+    matrix = vectorizer.transform([doc for _, doc in candidates])
+    scores = score_matrix(profile_vector, matrix)
 
-    return profile_vector, vectorizer, profile_hash
+    results = []
+    for i in select_top(scores, min_similarity, top_k):
+        result = candidates[i][0]
+        result["similarity"] = round(float(scores[i]), 3)
+        results.append(result)
+    return results
+
+def subject_cache_key(lang, subject, max_results):
+    return f"subject:v3:{lang}:{subject.strip().lower()}:{max_results}"
+
+# Raw subject-query results are user independent, so they are cached once for
+# every user and worker. Returns None on failure so errors are never cached.
+def fetch_subject_items(lang, subject, max_results, start_index=0):
+    try:
+        return search_volumes(
+            f'subject:"{subject}"',
+            max_results=max_results,
+            start_index=start_index,
+            order_by="relevance",
+            lang=lang,
+            print_type="books",
+            endpoint="subject",
+        )
+    except GoogleBooksError:
+        return None
+
+def run_in_app_context(app, fn, *args):
+    with app.app_context():
+        return fn(*args)
+
+def fetch_subject_until(until, lang, subject, max_results):
+    # Retries stop at the request's fetch deadline instead of outliving it.
+    with call_deadline(until):
+        return fetch_subject_items(lang, subject, max_results)
+
+def cache_late_result(backend, key, future, timeout, stale):
+    items = None if future.cancelled() or future.exception() else future.result()
+    if items is not None:
+        swr_set(key, items, timeout, backend=backend, stale=stale)
 
 def normalize_author(name):
     return re.sub(r"[^\w\s]", "", name.strip().lower())
 
+def volume_dedupe_key(title, authors):
+    return f"{title.strip().lower()}|{'|'.join(normalize_author(a) for a in authors)}"
+
+# Parses a Volume into (result dict, mapped main categories, TF-IDF document,
+# title|author dedupe key), or None when it can't be recommended.
+def parse_volume_candidate(volume):
+    gid = volume.google_id
+    title_raw = volume.title
+    authors = volume.authors
+    description = volume.description.strip()
+    if not authors or not description:
+        return None
+
+    language = volume.language
+    if language not in RECOMMEND_LANGUAGES:
+        return None
+
+    raw_categories = volume.categories
+    normalized_categories = normalize_categories(raw_categories)
+    mapped_categories = [map_to_main_category(cat) for cat in normalized_categories]
+
+    publisher = volume.publisher or "No disponible"
+    if publisher == "No disponible":
+        current_app.logger.warning(f"[RECOMMEND] Libro sin editorial: {title_raw} ({gid})")
+
+    isbn = volume.isbn
+
+    enriched = " ".join([
+        clean_text(title_raw),
+        clean_text(" ".join(authors)),
+        clean_text(",".join(mapped_categories)),
+        clean_text(language),
+        clean_text(publisher),
+        clean_text(description)
+    ])
+
+    candidate = {
+        "google_id": gid,
+        "id": gid,
+        "title": title_raw,
+        "author": ", ".join(authors),
+        "authors": authors,
+        "language": language,
+        "thumbnail": volume.thumbnail,
+        "categories": raw_categories,
+        "description": description,
+        "publisher": publisher,
+        "publishedDate": volume.published_date,
+        "isbn": isbn,
+        "matched_category": mapped_categories[0] if mapped_categories else "",
+        "matched_terms": []
+    }
+    return candidate, mapped_categories, enriched, volume_dedupe_key(title_raw, authors)
+
+# Full rows are loaded for at most this many winners per ranking.
+LOCAL_POOL_MAX_RESULTS = 200
+
+def rank_local_candidates(profile_vector, model_version, n_features, selected_categories, exclude_ids, min_similarity=0.2, top_k=None):
+    # Ranks the harvested pool for the selected categories. Returns None when
+    # the pool is too small to stand in for the live API. Scoring reads only
+    # the id, dedupe and vector columns of the LOCAL_POOL_MAX_CANDIDATES most
+    # recently harvested candidates; full rows are loaded for the winners only.
+    config = current_app.config
+    in_categories = (
+        db.session.query(CandidateCategory.google_id)
+        .filter(CandidateCategory.main_category.in_(selected_categories))
+    )
+    pool = (
+        db.session.query(CandidateVolume.google_id, CandidateVolume.dedupe_key, CandidateVolume.isbn, CandidateVolume.vector)
+        .filter(
+            CandidateVolume.google_id.in_(in_categories),
+            CandidateVolume.model_version == model_version,
+        )
+        .order_by(CandidateVolume.harvested_at.desc())
+        .limit(config.get("LOCAL_POOL_MAX_CANDIDATES", 5000))
+        .all()
+    )
+    pool = [row for row in pool if row.google_id not in exclude_ids]
+    if len(pool) < config.get("LOCAL_POOL_MIN_CANDIDATES", 100):
+        return None
+
+    scores = score_matrix(profile_vector, decode_vectors([row.vector for row in pool], n_features))
+
+    limit = top_k or LOCAL_POOL_MAX_RESULTS
+    winners, seen_keys, seen_isbns = [], set(), set()
+    for i in select_top(scores, min_similarity):
+        row = pool[i]
+        if row.dedupe_key in seen_keys or (row.isbn and row.isbn in seen_isbns):
+            continue
+        seen_keys.add(row.dedupe_key)
+        if row.isbn:
+            seen_isbns.add(row.isbn)
+        winners.append((row.google_id, round(float(scores[i]), 3)))
+        if len(winners) >= limit:
+            break
+
+    candidates = {
+        row.google_id: row for row in
+        CandidateVolume.query
+        .filter(CandidateVolume.google_id.in_([gid for gid, _ in winners]))
+        .options(selectinload(CandidateVolume.main_categories))
+    }
+    results = []
+    for gid, similarity in winners:
+        row = candidates.get(gid)
+        if row is None:
+            continue
+        mapped_categories = [link.main_category for link in row.main_categories]
+        results.append({
+            "google_id": row.google_id,
+            "id": row.google_id,
+            "title": row.title,
+            "author": ", ".join(row.authors),
+            "authors": row.authors,
+            "language": row.language,
+            "thumbnail": row.thumbnail,
+            "categories": row.categories or [],
+            "description": row.description or "",
+            "publisher": row.publisher,
+            "publishedDate": row.published_date or "",
+            "isbn": row.isbn,
+            "similarity": similarity,
+            "matched_category": mapped_categories[0] if mapped_categories else "",
+            "matched_terms": [cat for cat in mapped_categories if cat in selected_categories]
+        })
+    return results
+
 def fetch_google_books(
     profile_vector,
     vectorizer,
-    api_key,
     user_books,
     shown_ids=None,
     selected_categories=None,
     max_results=40,
-    min_similarity=0.2
+    min_similarity=0.2,
+    top_k=None
 ):
     if profile_vector is None or not selected_categories:
         return []
@@ -108,127 +299,399 @@ def fetch_google_books(
     user_ids = {b.google_id.strip() for b in user_books if b.google_id}
     shown_ids.update(user_ids)
 
+    shared_vectorizer, model_version = get_shared_vectorizer()
+    if shared_vectorizer is not None and vectorizer is shared_vectorizer:
+        results = rank_local_candidates(
+            profile_vector, model_version, len(vectorizer.vocabulary_),
+            selected_categories, shown_ids, min_similarity, top_k,
+        )
+        if results is not None:
+            current_app.logger.info(f"[RECOMMEND] {len(results)} libros recomendados desde el catálogo local.")
+            return results
+
     seen_keys, seen_isbns = set(), set()
-    results = []
+    candidates = []
 
     categories_to_use = []
     for cat in selected_categories:
         categories_to_use.extend(CATEGORY_GROUPS.get(cat, [cat]))
 
-    def fetch_items(lang, query):
-        params = {
-            "q": f'subject:"{query}"',
-            "langRestrict": lang,
-            "maxResults": max_results,
-            "printType": "books",
-            "orderBy": "relevance",
-            "key": api_key
-        }
-        try:
-            response = requests.get("https://www.googleapis.com/books/v1/volumes", params=params, timeout=6)
-            if response.status_code != 200:
-                return []
-            return response.json().get("items", [])
-        except requests.RequestException:
-            return []
-
-    items = []
-    for query in categories_to_use:
-        items += fetch_items("es", query)
-        items += fetch_items("en", query)
-
-    current_app.logger.info(f"[RECOMMEND] Libros recibidos antes de filtrar: {len(items)}")
-
-    for item in items:
-        volume = item.get("volumeInfo", {})
-        gid = item.get("id", "").strip()
-
-        if gid in shown_ids:
-            continue
-
-        title_raw = volume.get("title", "").strip()
-        title = title_raw.lower()
-        authors = volume.get("authors", [])
-        normalized_authors = [normalize_author(a) for a in authors]
-        title_author_key = f"{title}|{'|'.join(normalized_authors)}"
-
-        if title_author_key in seen_keys:
-            continue
-
-        description = volume.get("description", "")
-        if not authors or not description:
-            continue
-
-        raw_categories = volume.get("categories", [])
-        normalized_categories = normalize_categories(raw_categories)
-        mapped_categories = [map_to_main_category(cat) for cat in normalized_categories]
+    def filter_volume(volume):
+        parsed = parse_volume_candidate(volume)
+        if parsed is None:
+            return None
+        candidate, mapped_categories, enriched, title_author_key = parsed
+        gid, isbn = candidate["google_id"], candidate["isbn"]
 
+        if gid in shown_ids or title_author_key in seen_keys:
+            return None
         if not any(cat in selected_categories for cat in mapped_categories):
-            continue
-
-        language = volume.get("language", "")
-        if language not in ("es", "en"):
-            continue
-
-        publisher_raw = volume.get("publisher")
-        publisher = publisher_raw.strip() if isinstance(publisher_raw, str) and publisher_raw.strip() else "No disponible"
-        if publisher == "No disponible":
-            current_app.logger.warning(f"[RECOMMEND] Libro sin editorial: {title_raw} ({gid})")
-
-        description_raw = volume.get("description")
-        description = description_raw.strip() if isinstance(description_raw, str) and description_raw.strip() else ""
-        if not description:
-            current_app.logger.warning(f"[RECOMMEND] Libro sin descripción: {title_raw} ({gid})")
-
-
-        industry_ids = volume.get("industryIdentifiers", [])
-        isbn = next((
-            identifier.get("identifier", "").replace("-", "").strip()
-            for identifier in industry_ids
-            if identifier.get("type") in ("ISBN_13", "ISBN_10")
-        ), None)
+            return None
         if isbn and isbn in seen_isbns:
-            continue
-
-        enriched = " ".join([
-            clean_text(title_raw),
-            clean_text(" ".join(authors)),
-            clean_text(",".join(mapped_categories)),
-            clean_text(language),
-            clean_text(publisher),
-            clean_text(description)
-        ])
-        book_vector = vectorizer.transform([enriched])
-        score = cosine_similarity([profile_vector], book_vector)[0][0]
-
-        if score < min_similarity:
-            continue
-
-        result = {
-            "google_id": gid,
-            "id": gid,
-            "title": title_raw,
-            "author": ", ".join(authors),
-            "authors": authors,
-            "language": language,
-            "thumbnail": volume.get("imageLinks", {}).get("thumbnail"),
-            "categories": raw_categories,
-            "description": description,
-            "publisher": publisher,
-            "publishedDate": volume.get("publishedDate", ""),
-            "isbn": isbn,
-            "similarity": round(score, 3),
-            "matched_category": mapped_categories[0] if mapped_categories else "",
-            "matched_terms": [cat for cat in mapped_categories if cat in selected_categories]
-        }
+            return None
 
-        results.append(result)
+        candidate["matched_terms"] = [cat for cat in mapped_categories if cat in selected_categories]
         shown_ids.add(gid)
         seen_keys.add(title_author_key)
         if isbn:
             seen_isbns.add(isbn)
-
-    results.sort(key=lambda x: x["similarity"], reverse=True)
+        return candidate, enriched
+
+    pool = get_fetch_pool()
+    app = current_app._get_current_object()
+    deadline = current_app.config.get("RECOMMEND_FETCH_DEADLINE", 8)
+    subject_timeout = current_app.config.get("SUBJECT_CACHE_TIMEOUT", 3600)
+    until = time.monotonic() + deadline
+
+    queries = [(lang, query) for query in categories_to_use for lang in RECOMMEND_LANGUAGES]
+    cache_keys = [subject_cache_key(lang, query, max_results) for lang, query in queries]
+    cached = cache.get_many(*cache_keys)
+
+    cached_items, futures, stale = [], {}, 0
+    for (lang, query), key, entry in zip(queries, cache_keys, cached):
+        if entry is not None:
+            items, is_stale = unwrap(entry)
+            cached_items.extend(items)
+            if is_stale:
+                stale += 1
+                refresh_in_background(
+                    key, lambda lang=lang, query=query: fetch_subject_items(lang, query, max_results), subject_timeout
+                )
+        else:
+            futures[pool.submit(run_in_app_context, app, fetch_subject_until, until, lang, query, max_results)] = key
+    current_app.logger.info(
+        f"[RECOMMEND] Consultas por tema: {len(queries) - len(futures)} en caché ({stale} caducadas), "
+        f"{len(futures)} a la API."
+    )
+
+    for volume in cached_items:
+        candidate = filter_volume(volume)
+        if candidate:
+            candidates.append(candidate)
+
+    received = len(cached_items)
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            items = future.result()
+            if items is None:
+                continue
+            swr_set(futures[future], items, subject_timeout)
+            received += len(items)
+            for volume in items:
+                candidate = filter_volume(volume)
+                if candidate:
+                    candidates.append(candidate)
+    except FuturesTimeoutError:
+        pending = [futures[f] for f in futures if not f.done()]
+        # Calls already in flight still warm the shared cache for the next request.
+        backend, stale_for = cache.cache, stale_timeout()
+        for f, key in futures.items():
+            if not f.done() and not f.cancel():
+                f.add_done_callback(
+                    lambda f, key=key: cache_late_result(backend, key, f, subject_timeout, stale_for)
+                )
+        current_app.logger.warning(
+            f"[RECOMMEND] Límite de {deadline}s alcanzado; {len(pending)} consultas descartadas: {pending}"
+        )
+
+    current_app.logger.info(f"[RECOMMEND] Libros recibidos antes de filtrar: {received}")
+
+    results = score_candidates(profile_vector, vectorizer, candidates, min_similarity, top_k)
     avg_score = np.mean([r["similarity"] for r in results]) if results else 0
     current_app.logger.info(f"[RECOMMEND] {len(results)} libros recomendados. Similitud promedio: {avg_score:.3f}")
     return results
+
+
+
+def get_user_library_books(user_id):
+    return (
+        Book.query
+        .join(LibraryBook, LibraryBook.book_id == Book.id)
+        .join(UserLibrary, UserLibrary.id == LibraryBook.library_id)
+        .filter(UserLibrary.user_id == user_id)
+        .all()
+    )
+
+def recommendation_keys(user_id, profile_key):
+    return f"recommendations:{user_id}:{profile_key}", f"recommendations_rotation:{user_id}:{profile_key}"
+
+# The ranked list is a Redis list of pre-serialized JSON items and the rotation
+# cursor a counter next to it. The script advances the cursor and reads only the
+# requested page in one atomic step, so concurrent clicks never get the same batch.
+_NEXT_PAGE_SCRIPT = """
+local n = redis.call('LLEN', KEYS[1])
+if n == 0 then return false end
+local size = tonumber(ARGV[1])
+local start = (redis.call('INCRBY', KEYS[2], size) - size) % n
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return redis.call('LRANGE', KEYS[1], start, start + size - 1)
+"""
+_next_page = redis_client.register_script(_NEXT_PAGE_SCRIPT)
+
+def store_recommendations(user_id, profile_key, recommendations, rotation_index=0):
+    list_key, rotation_key = recommendation_keys(user_id, profile_key)
+    for r in recommendations:
+        if "similarity" in r:
+            r["similarity"] = float(r["similarity"])
+    items = [json.dumps(r, ensure_ascii=False, separators=(",", ":")) for r in recommendations]
+
+    try:
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(list_key)
+        if items:
+            pipe.rpush(list_key, *items)
+            pipe.expire(list_key, RECOMMENDATIONS_TIMEOUT)
+        pipe.set(rotation_key, rotation_index, ex=RECOMMENDATIONS_TIMEOUT)
+        pipe.execute()
+    except RedisError as e:
+        current_app.logger.warning(f"[RECOMMEND] No se pudieron guardar las recomendaciones de {user_id}: {e}")
+
+def has_recommendations(user_id, profile_key):
+    try:
+        return bool(redis_client.exists(recommendation_keys(user_id, profile_key)[0]))
+    except RedisError:
+        return False
+
+def next_recommendation_page(user_id, profile_key, size=3):
+    # Returns the next page as a list of serialized JSON items, or None on a miss.
+    list_key, rotation_key = recommendation_keys(user_id, profile_key)
+    try:
+        page = _next_page(keys=[list_key, rotation_key], args=[size, RECOMMENDATIONS_TIMEOUT])
+    except RedisError as e:
+        # Treated as a miss: the caller ranks afresh.
+        current_app.logger.warning(f"[RECOMMEND] Rotación no disponible para {user_id}: {e}")
+        return None
+    return [item.decode("utf-8") for item in page] if page else None
+
+def library_version(user_id):
+    return int(redis_client.get(f"library_version:{user_id}") or 0)
+
+def read_library_version(user_id):
+    # None when Redis is unavailable.
+    try:
+        return library_version(user_id)
+    except RedisError as e:
+        current_app.logger.warning(f"[RECOMMEND] Versión de biblioteca no disponible para usuario {user_id}: {e}")
+        return None
+
+def get_library_snapshot(user_id):
+    # Returns (user_books, library version). The version is read before the
+    # books: a change committed after this load bumps it past the returned
+    # value, so profile sums built from these books are never stamped current.
+    version = read_library_version(user_id)
+    return get_user_library_books(user_id), version
+
+def profile_key(version, model_version, selected_categories=None):
+    # Identifies a ranking: it changes whenever the library, the shared model
+    # or the category selection does, so it can be built before any book is loaded.
+    selection = "|".join(selected_categories or []) or PROFILE_ALL
+    return f"v{'na' if version is None else version}:{model_version or 'local'}:{selection}"
+
+# Per-user profiles live in Redis as running sums of book vectors in the shared
+# TF-IDF space, one hash per main category (plus PROFILE_ALL) mapping term index
+# -> summed weight, with the number of books under "_count".
+def profile_base(model_version, user_id):
+    return f"profile:{model_version}:{user_id}"
+
+def _add_profile_vector(pipe, key, vector, sign):
+    for idx, value in zip(vector.indices, vector.data):
+        pipe.hincrbyfloat(key, int(idx), sign * float(value))
+    pipe.hincrby(key, "_count", sign)
+    pipe.expire(key, PROFILE_TIMEOUT)
+
+def profile_fingerprint(document, mapped):
+    # Identifies what a book contributed to the sums, so a removal can tell
+    # whether the book still has the document and categories it was added with.
+    return hashlib.sha1(("|".join(sorted(mapped)) + "\n" + document).encode("utf-8")).hexdigest()[:16]
+
+def rebuild_profile_sums(user_id, user_books, vectorizer, model_version, version_before):
+    # version_before must be read before user_books was loaded (see get_library_snapshot).
+    base = profile_base(model_version, user_id)
+
+    docs, book_categories, fingerprints = [], [], {}
+    for b in user_books:
+        categories = profile_categories(b)
+        if categories is None:
+            continue
+        normalized, mapped = categories
+        document = book_document(b, normalized)
+        docs.append(document)
+        book_categories.append(mapped | {PROFILE_ALL})
+        fingerprints[b.id] = profile_fingerprint(document, mapped)
+
+    pipe = redis_client.pipeline(transaction=True)
+    old_categories = redis_client.smembers(f"{base}:categories")
+    for cat in old_categories:
+        pipe.delete(f"{base}:{cat.decode('utf-8')}")
+    pipe.delete(f"{base}:categories")
+    pipe.delete(f"{base}:books")
+    if fingerprints:
+        pipe.hset(f"{base}:books", mapping=fingerprints)
+        pipe.expire(f"{base}:books", PROFILE_TIMEOUT)
+
+    if docs:
+        matrix = vectorizer.transform(docs).tocsr()
+        for cat in set().union(*book_categories):
+            rows = [i for i, cats in enumerate(book_categories) if cat in cats]
+            summed = np.asarray(matrix[rows].sum(axis=0)).ravel()
+            nonzero = np.flatnonzero(summed)
+            mapping = {int(i): float(summed[i]) for i in nonzero}
+            mapping["_count"] = len(rows)
+            pipe.hset(f"{base}:{cat}", mapping=mapping)
+            pipe.expire(f"{base}:{cat}", PROFILE_TIMEOUT)
+            pipe.sadd(f"{base}:categories", cat)
+    pipe.set(f"{base}:built", version_before, ex=PROFILE_TIMEOUT)
+    pipe.expire(f"{base}:categories", PROFILE_TIMEOUT)
+    pipe.execute()
+
+    # A library change that landed while we were reading is not in these sums;
+    # drop the marker so the next read rebuilds instead of serving a stale profile.
+    if library_version(user_id) != version_before:
+        redis_client.delete(f"{base}:built")
+
+def record_library_change(user_id, book, sign):
+    # sign: +1 when the book is added to the library, -1 when removed. Runs
+    # after the library row is committed. The delta is applied only to sums
+    # built for exactly the previous library version, and advances their
+    # built marker to the new one; anything else drops the marker so the next
+    # read rebuilds.
+    try:
+        version = redis_client.incr(f"library_version:{user_id}")
+        vectorizer, model_version = get_shared_vectorizer()
+        if vectorizer is None:
+            return
+        base = profile_base(model_version, user_id)
+        built_key, books_key = f"{base}:built", f"{base}:books"
+
+        categories = profile_categories(book)
+        fingerprint = None
+        if categories is not None:
+            normalized, mapped = categories
+            document = book_document(book, normalized)
+            fingerprint = profile_fingerprint(document, mapped)
+
+        try:
+            with redis_client.pipeline(transaction=True) as pipe:
+                # A rebuild landing between the reads and the write changes
+                # one of the watched keys and aborts the transaction.
+                pipe.watch(built_key, books_key)
+                built = pipe.get(built_key)
+                if built is None:
+                    return
+                stored = pipe.hget(books_key, book.id)
+                stored = stored.decode("utf-8") if stored else None
+
+                if int(built) != version - 1:
+                    # Sums from another version (a concurrent change or rebuild).
+                    stale = True
+                elif sign > 0:
+                    # A rebuild that read the new row already counted the book;
+                    # any other stored fingerprint means it is in the sums
+                    # with different content.
+                    stale = stored is not None and stored != fingerprint
+                else:
+                    # The book's document or categories changed since it was
+                    # added, so its original contribution can't be subtracted.
+                    stale = stored != fingerprint
+                apply = not stale and fingerprint is not None and (sign < 0 or stored is None)
+
+                pipe.multi()
+                if stale:
+                    pipe.delete(built_key)
+                    pipe.execute()
+                    return
+                if apply:
+                    vector = vectorizer.transform([document]).tocsr()
+                    for cat in mapped | {PROFILE_ALL}:
+                        _add_profile_vector(pipe, f"{base}:{cat}", vector, sign)
+                        pipe.sadd(f"{base}:categories", cat)
+                    if sign > 0:
+                        pipe.hset(books_key, book.id, fingerprint)
+                    else:
+                        pipe.hdel(books_key, book.id)
+                    pipe.expire(books_key, PROFILE_TIMEOUT)
+                pipe.set(built_key, version, ex=PROFILE_TIMEOUT)
+                pipe.execute()
+        except WatchError:
+            redis_client.delete(built_key)
+    except RedisError as e:
+        current_app.logger.warning(f"[RECOMMEND] No se pudo actualizar el perfil del usuario {user_id}: {e}")
+
+def record_library_import(user_id):
+    # Bulk imports are not applied book by book: the built marker is dropped so
+    # the next read rebuilds the profile sums in one pass.
+    try:
+        redis_client.incr(f"library_version:{user_id}")
+        _, model_version = get_shared_vectorizer()
+        if model_version:
+            redis_client.delete(f"{profile_base(model_version, user_id)}:built")
+    except RedisError as e:
+        current_app.logger.warning(f"[RECOMMEND] No se pudo invalidar el perfil del usuario {user_id}: {e}")
+
+def load_profile_vector(vectorizer, key):
+    data = redis_client.hgetall(key)
+    count = int(data.pop(b"_count", 0) or 0)
+    if count <= 0 or not data:
+        return None
+    vector = np.zeros(len(vectorizer.vocabulary_), dtype=np.float64)
+    indices = np.fromiter((int(k) for k in data.keys()), dtype=np.int64, count=len(data))
+    values = np.fromiter((float(v) for v in data.values()), dtype=np.float64, count=len(data))
+    vector[indices] = values
+    return vector / count
+
+def get_user_profile(user_id, user_books, selected_categories=None, version=None):
+    # Returns (profile_vector, vectorizer, profile_key). profile_key changes
+    # whenever the library, the shared model or the category selection does.
+    # version is the library version read before user_books was loaded.
+    selection = "|".join(selected_categories or []) or PROFILE_ALL
+    vectorizer, model_version = get_shared_vectorizer()
+    incremental = vectorizer is not None and (not selected_categories or len(selected_categories) == 1)
+    try:
+        if version is not None and incremental:
+            base = profile_base(model_version, user_id)
+            built = redis_client.get(f"{base}:built")
+            if built is None or int(built) != version:
+                rebuild_profile_sums(user_id, user_books, vectorizer, model_version, version)
+            profile_vector = load_profile_vector(vectorizer, f"{base}:{selection}")
+            return profile_vector, vectorizer, profile_key(version, model_version, selected_categories)
+    except RedisError as e:
+        current_app.logger.warning(f"[RECOMMEND] Perfil incremental no disponible para usuario {user_id}: {e}")
+        version = None
+
+    profile_vector, vectorizer = build_user_profile(user_books, selected_categories)
+    return profile_vector, vectorizer, profile_key(version, model_version, selected_categories)
+
+def rank_recommendations(profile_vector, vectorizer, user_books, selected_categories):
+    # Content-based candidates from Google Books blended with "readers also
+    # shelved" neighbors from our own library data.
+    recommendations = fetch_google_books(
+        profile_vector,
+        vectorizer,
+        user_books,
+        set(),
+        selected_categories=selected_categories,
+        min_similarity=0.2,
+    )
+    neighbors = neighbor_recommendations(user_books, selected_categories)
+    return blend_recommendations(recommendations, neighbors)
+
+@job("recommendations.precompute")
+def precompute_recommendations(user_id):
+    user_books, version = get_library_snapshot(user_id)
+    if len(user_books) < 3:
+        return
+
+    for category in sorted(user_main_categories(user_id)):
+        if category == "Other":
+            continue
+        selected_categories = [category]
+        profile_vector, vectorizer, profile_key = get_user_profile(user_id, user_books, selected_categories, version)
+        if profile_vector is None:
+            continue
+        if has_recommendations(user_id, profile_key):
+            continue
+
+        recommendations = rank_recommendations(profile_vector, vectorizer, user_books, selected_categories)
+        if recommendations:
+            store_recommendations(user_id, profile_key, recommendations)
+        current_app.logger.info(f"[RECOMMEND] Precalculadas {len(recommendations)} recomendaciones de '{category}' para usuario {user_id}.")
@@ -0,0 +1,249 @@
+import math
+from itertools import zip_longest
+
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import selectinload
+
+from app.extensions import cache, db
+from app.models import Book
+from app.utils.google_books import (
+    RETRY_STATUSES,
+    GoogleBooksError,
+    GoogleBooksHTTPError,
+    fetch_concurrently,
+    search_volumes,
+)
+from app.utils.swr_cache import refresh_in_background, swr_set, unwrap
+from app.utils.text import clean_description
+
+SEARCH_PAGE_SIZE = 10
+# One API call per language fetches a whole window; pages are sliced locally.
+SEARCH_WINDOW = 40
+# Local catalog hits lead the first window, one page's worth at most.
+LOCAL_RESULTS = SEARCH_PAGE_SIZE
+# MySQL's "Can't find FULLTEXT index matching the column list".
+ER_FT_MATCHING_KEY_NOT_FOUND = 1191
+# Set once MySQL reports ft_books_search missing; `flask search index` creates
+# it, and the next worker restart uses it.
+_fulltext_missing = False
+
+
+def canonical_text(value):
+    return " ".join((value or "").lower().split())
+
+
+def build_query(query, author=None, publisher=None):
+    # Case and whitespace are normalized so equivalent searches share one cache entry.
+    parts = [canonical_text(query)]
+    if canonical_text(author):
+        parts.append(f"inauthor:{canonical_text(author)}")
+    if canonical_text(publisher):
+        parts.append(f"inpublisher:{canonical_text(publisher)}")
+    return " ".join(p for p in parts if p)
+
+
+def canonical_languages(langs):
+    # Order is kept: it decides which language leads the merged ranking.
+    return list(dict.fromkeys(canonical_text(lang) for lang in langs if canonical_text(lang)))
+
+
+def window_cache_key(q, order_by, lang, window):
+    # One entry per language, so toggling a language filter reuses the others.
+    return f"search:v4:{order_by}:{lang}:w{window}:{q}"
+
+
+def max_windows():
+    # SEARCH_MAX_RESULTS is per language, and so is a window.
+    return math.ceil(current_app.config.get("SEARCH_MAX_RESULTS", 200) / SEARCH_WINDOW)
+
+
+def total_pages(item_count, more, langs):
+    # Pages of the merged results loaded so far, plus one more while the API
+    # has results left; that page is filled from the next window when asked for.
+    pages = max(1, math.ceil(item_count / SEARCH_PAGE_SIZE)) + (1 if more else 0)
+    return min(pages, max_search_pages(langs))
+
+
+def search_result(volume):
+    return {
+        "google_id": volume.google_id,
+        "title": volume.title,
+        "authors": volume.authors,
+        "language": volume.language,
+        "thumbnail": volume.thumbnail,
+        "description": clean_description(volume.description),
+        "publisher": volume.publisher,
+        "publishedDate": volume.published_date,
+        "categories": volume.categories,
+        "isbn": volume.isbn,
+    }
+
+
+def fetch_window(q, order_by, lang, window):
+    try:
+        raw_results = search_volumes(
+            q,
+            max_results=SEARCH_WINDOW,
+            start_index=window * SEARCH_WINDOW,
+            order_by=order_by,
+            lang=lang,
+        )
+    except GoogleBooksHTTPError as e:
+        if e.status in RETRY_STATUSES:
+            raise
+        # The API rejected the query itself (e.g. 400 on a malformed one):
+        # it has no results, which is not a connection error.
+        return {"items": [], "more": False}
+    items = [
+        search_result(volume) for volume in raw_results
+        if volume.title and volume.authors and volume.language == lang
+    ]
+    # A full window means the API probably has more results after it.
+    return {"items": items, "more": len(raw_results) == SEARCH_WINDOW}
+
+
+def unique_results(items):
+    # Keeps the first occurrence of each volume (same volume id or same ISBN).
+    unique, seen_ids, seen_isbns = [], set(), set()
+    for item in items:
+        if item["google_id"] in seen_ids:
+            continue
+        if item["isbn"] and item["isbn"] in seen_isbns:
+            continue
+        seen_ids.add(item["google_id"])
+        if item["isbn"]:
+            seen_isbns.add(item["isbn"])
+        unique.append(item)
+    return unique
+
+
+def interleave_results(ranked_lists):
+    # Round-robin over the per-language rankings, keeping each list's order.
+    return unique_results(
+        item for group in zip_longest(*ranked_lists) for item in group if item is not None
+    )
+
+
+def local_result(book):
+    return {
+        "google_id": book.google_id,
+        "title": book.title,
+        "authors": book.authors_list,
+        "language": book.language,
+        "thumbnail": book.thumbnail,
+        "description": book.description or "",
+        "publisher": book.publisher or "",
+        "publishedDate": book.published_date or "",
+        "categories": book.categories_list,
+        "isbn": book.isbn,
+        "source": "local",
+    }
+
+
+def local_search(query, author=None, publisher=None, langs=None, limit=LOCAL_RESULTS):
+    # Searches the books anyone has shelved without spending API quota. MySQL
+    # uses the ft_books_search FULLTEXT index ranked by relevance; other
+    # databases, or a MySQL database without the index, fall back to matching
+    # every term with LIKE.
+    global _fulltext_missing
+    text, author, publisher = canonical_text(query), canonical_text(author), canonical_text(publisher)
+    books = Book.query.options(selectinload(Book.indexed_authors), selectinload(Book.indexed_categories))
+    if langs:
+        books = books.filter(Book.language.in_(langs))
+    if author:
+        books = books.filter(Book.authors.contains(author, autoescape=True))
+    if publisher:
+        books = books.filter(Book.publisher.contains(publisher, autoescape=True))
+
+    if text and db.engine.dialect.name == "mysql" and not _fulltext_missing:
+        relevance = match(Book.title, Book.authors, Book.publisher, Book.categories, against=text)
+        try:
+            return [
+                local_result(book)
+                for book in books.filter(relevance > 0).order_by(relevance.desc()).limit(limit)
+            ]
+        except DBAPIError as e:
+            if not e.orig.args or e.orig.args[0] != ER_FT_MATCHING_KEY_NOT_FOUND:
+                raise
+            _fulltext_missing = True
+            current_app.logger.warning(
+                "[SEARCH] Falta el índice FULLTEXT ft_books_search; se usa LIKE. Ejecuta `flask search index`."
+            )
+
+    for term in text.split():
+        books = books.filter(or_(
+            Book.title.contains(term, autoescape=True),
+            Book.authors.contains(term, autoescape=True),
+            Book.publisher.contains(term, autoescape=True),
+            Book.categories.contains(term, autoescape=True),
+        ))
+    return [local_result(book) for book in books.order_by(Book.title).limit(limit)]
+
+
+def get_search_window(q, order_by, langs, window):
+    # Each language's window comes from its own cache entry (stale ones are
+    # served and refreshed in the background); missing languages are fetched
+    # concurrently. Raises GoogleBooksError only if nothing could be served.
+    keys = [window_cache_key(q, order_by, lang, window) for lang in langs]
+    windows = {}
+    for lang, key, entry in zip(langs, keys, cache.get_many(*keys)):
+        if entry is None:
+            continue
+        windows[lang], is_stale = unwrap(entry)
+        if is_stale:
+            refresh_in_background(key, lambda lang=lang: fetch_window(q, order_by, lang, window))
+
+    missing = [lang for lang in langs if lang not in windows]
+    if missing:
+        fetched = fetch_concurrently(lambda lang: fetch_window(q, order_by, lang, window), missing, len(missing))
+        if not fetched and not windows:
+            raise GoogleBooksError(f"Google Books search: sin respuesta para {', '.join(missing)}")
+        for lang, data in fetched.items():
+            swr_set(window_cache_key(q, order_by, lang, window), data)
+        windows.update(fetched)
+
+    ranked = [windows[lang]["items"] for lang in langs if lang in windows]
+    return {
+        "items": interleave_results(ranked),
+        "more": any(windows[lang]["more"] for lang in windows),
+    }
+
+
+def search_results(q, order_by, langs, local, needed):
+    # The merged results up to at least `needed` items: local hits first, then
+    # windows 0, 1, ... each without the volumes already listed (same id or
+    # ISBN), so a book never shows up again on a later page. Pages are slices
+    # of this list, whatever the length of each window after deduping.
+    # Windows come from the cache the pages before filled, so only a cold
+    # window waits on the API. Returns {"items", "more", "windows"}; raises
+    # GoogleBooksError only when the requested page can't be filled at all.
+    items, window, more = unique_results(local), 0, True
+    while more and len(items) < needed and window < max_windows():
+        try:
+            data = get_search_window(q, order_by, langs, window)
+        except GoogleBooksError:
+            if len(items) <= needed - SEARCH_PAGE_SIZE:
+                raise
+            more = False
+            break
+        items = unique_results(items + data["items"])
+        more = data["more"]
+        window += 1
+    return {"items": items, "more": more and window < max_windows(), "windows": window}
+
+
+def prefetch_window(q, order_by, langs, window):
+    for lang in langs:
+        key = window_cache_key(q, order_by, lang, window)
+        if cache.has(key):
+            continue
+        current_app.logger.info(f"[SEARCH] Precargando ventana {window} ({lang}) para: {q}")
+        refresh_in_background(key, lambda lang=lang: fetch_window(q, order_by, lang, window))
+
+
+def max_search_pages(langs):
+    # SEARCH_MAX_RESULTS is per language.
+    return current_app.config.get("SEARCH_MAX_RESULTS", 200) * max(1, len(langs)) // SEARCH_PAGE_SIZE
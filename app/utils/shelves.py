@@ -0,0 +1,167 @@
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
+
+from app.extensions import db, redis_client
+from app.models import Book, LibraryBook, UserLibrary, Wishlist, WishlistBook
+
+SHELF_PAGE_SIZE = 12
+MEMBERSHIP_TTL = 86400
+# Kept in every membership set so an empty shelf is still a cache hit.
+_LOADED = "-"
+
+# Link model, owner column and owner model for each shelf.
+SHELVES = {
+    "library": (LibraryBook, LibraryBook.library_id, UserLibrary),
+    "wishlist": (WishlistBook, WishlistBook.wishlist_id, Wishlist),
+}
+
+# Applies a toggle to a membership set only if it is loaded; a missing set is
+# rebuilt from the database on the next read instead of starting half empty.
+# Every toggle also bumps the shelf's generation (KEYS[2]), so a rebuild that
+# read the database before the toggle can tell its snapshot is stale.
+_UPDATE_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], %d)
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return 0
+end
+for i = 2, #ARGV do
+  if ARGV[1] == 'add' then
+    redis.call('SADD', KEYS[1], ARGV[i])
+  else
+    redis.call('SREM', KEYS[1], ARGV[i])
+  end
+end
+redis.call('EXPIRE', KEYS[1], %d)
+return 1
+""" % (MEMBERSHIP_TTL, MEMBERSHIP_TTL)
+
+# Stores a rebuilt membership set only if no toggle ran since the generation
+# ARGV[1] was read (and no other rebuild got there first).
+_FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] or redis.call('EXISTS', KEYS[1]) == 1 then
+  return 0
+end
+for i = 2, #ARGV do
+  redis.call('SADD', KEYS[1], ARGV[i])
+end
+redis.call('EXPIRE', KEYS[1], %d)
+return 1
+""" % MEMBERSHIP_TTL
+
+_update_membership = redis_client.register_script(_UPDATE_SCRIPT)
+_fill_membership = redis_client.register_script(_FILL_SCRIPT)
+
+
+def shelf_order(link, sort):
+    # Book.id breaks ties so pages never repeat or skip a book.
+    if sort == "title_asc":
+        return Book.title.asc(), Book.id
+    if sort == "title_desc":
+        return Book.title.desc(), Book.id.desc()
+    if sort == "oldest":
+        return link.added_at.asc(), Book.id
+    return link.added_at.desc(), Book.id.desc()
+
+
+def shelf_page(shelf, owner_id, search="", sort="recent", page=1, per_page=SHELF_PAGE_SIZE):
+    # Returns (books, total) for one page of a library or wishlist, filtered,
+    # sorted and paginated in SQL. The (owner, added_at) indexes back the date
+    # sorts; Book rows come back from the same join, one query per page, plus
+    # one each for their authors and categories.
+    link, owner, _ = SHELVES[shelf]
+    query = db.session.query(Book).join(link, link.book_id == Book.id).filter(owner == owner_id)
+    if search:
+        query = query.filter(or_(
+            Book.title.contains(search, autoescape=True),
+            Book.authors.contains(search, autoescape=True),
+        ))
+
+    total = query.order_by(None).count()
+    page = max(1, page)
+    books = (
+        query.order_by(*shelf_order(link, sort))
+        .options(selectinload(Book.indexed_authors), selectinload(Book.indexed_categories))
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+        .all()
+    )
+    return books, total
+
+
+def shelf_google_ids(shelf, user_id):
+    link, owner, owner_model = SHELVES[shelf]
+    return {
+        gid for (gid,) in db.session.query(Book.google_id)
+        .join(link, link.book_id == Book.id)
+        .join(owner_model, owner_model.id == owner)
+        .filter(owner_model.user_id == user_id)
+    }
+
+
+def membership_key(user_id, shelf):
+    return f"shelf:{shelf}:{user_id}"
+
+
+def generation_key(user_id, shelf):
+    return f"shelf:{shelf}:{user_id}:gen"
+
+
+def shelf_membership(user_id):
+    # Returns {"library": set, "wishlist": set} of google_ids for the card
+    # templates. Served from per-user Redis sets; a missing set is rebuilt with
+    # one google_id query, so a warm page render reads no shelf rows at all.
+    shelves = list(SHELVES)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for shelf in shelves:
+            pipe.smembers(membership_key(user_id, shelf))
+            pipe.get(generation_key(user_id, shelf))
+        cached = pipe.execute()
+    except RedisError as e:
+        current_app.logger.warning(f"[SHELVES] Sin caché de pertenencia para {user_id}: {e}")
+        return {shelf: shelf_google_ids(shelf, user_id) for shelf in shelves}
+
+    membership = {}
+    for shelf, members, generation in zip(shelves, cached[::2], cached[1::2]):
+        if members:
+            membership[shelf] = {m.decode("utf-8") for m in members} - {_LOADED}
+            continue
+        # The generation was read before the database, so a toggle committed
+        # after our query bumps it and the stale set is not stored.
+        membership[shelf] = shelf_google_ids(shelf, user_id)
+        try:
+            _fill_membership(
+                keys=[membership_key(user_id, shelf), generation_key(user_id, shelf)],
+                args=[(generation or b"").decode("utf-8"), _LOADED, *membership[shelf]],
+            )
+        except RedisError as e:
+            current_app.logger.warning(f"[SHELVES] No se pudo guardar la pertenencia de {user_id}: {e}")
+    return membership
+
+
+def _apply(user_id, shelf, action, google_ids):
+    google_ids = [gid for gid in google_ids if gid]
+    if not google_ids:
+        return
+    try:
+        _update_membership(
+            keys=[membership_key(user_id, shelf), generation_key(user_id, shelf)], args=[action, *google_ids]
+        )
+    except RedisError as e:
+        # Drop the set rather than leave it wrong; the next read rebuilds it.
+        current_app.logger.warning(f"[SHELVES] No se pudo actualizar {shelf} de {user_id}: {e}")
+        try:
+            redis_client.delete(membership_key(user_id, shelf))
+        except RedisError:
+            pass
+
+
+def add_to_shelf(user_id, shelf, *google_ids):
+    _apply(user_id, shelf, "add", google_ids)
+
+
+def remove_from_shelf(user_id, shelf, *google_ids):
+    _apply(user_id, shelf, "remove", google_ids)
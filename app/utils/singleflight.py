@@ -0,0 +1,76 @@
+import pickle
+import time
+import uuid
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app.extensions import redis_client
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_release = redis_client.register_script(_RELEASE_SCRIPT)
+
+
+# Seconds the lock outlives `wait`, so it never expires under a leader that
+# is still within its budget.
+LOCK_MARGIN = 2.0
+
+
+def single_flight(key, fn, lock_ttl=None, wait=3.0, result_ttl=15, poll_interval=0.05):
+    # Runs fn() on exactly one worker (across processes and nodes) for a given
+    # key. Concurrent callers block for up to `wait` seconds (which should
+    # cover fn's worst case) and reuse the leader's result, which stays
+    # readable for `result_ttl` seconds. A None result is not shared: it may be
+    # a failure, and each caller then runs fn() itself, as it does when the
+    # leader raises, times out, or Redis is unavailable.
+    if lock_ttl is None:
+        lock_ttl = wait + LOCK_MARGIN
+    lock_key = f"singleflight:lock:{key}"
+    result_key = f"singleflight:result:{key}"
+
+    token = None
+    try:
+        cached = redis_client.get(result_key)
+        if cached is not None:
+            return pickle.loads(cached)
+
+        token = uuid.uuid4().hex
+        if not redis_client.set(lock_key, token, nx=True, px=int(lock_ttl * 1000)):
+            token = None
+            deadline = time.monotonic() + wait
+            while time.monotonic() < deadline:
+                time.sleep(poll_interval)
+                cached = redis_client.get(result_key)
+                if cached is not None:
+                    return pickle.loads(cached)
+                if not redis_client.exists(lock_key):
+                    break
+            current_app.logger.info(f"[SINGLEFLIGHT] Sin resultado compartido para {key}; consultando directamente.")
+    except RedisError as e:
+        token = None
+        current_app.logger.warning(f"[SINGLEFLIGHT] Redis no disponible para {key}: {e}")
+
+    if token is None:
+        return fn()
+
+    # The result is published before the lock is released, so waiters never
+    # see the lock gone without a result to read.
+    try:
+        value = fn()
+        if value is None:
+            return value
+        try:
+            redis_client.set(result_key, pickle.dumps(value), px=int(result_ttl * 1000))
+        except RedisError as e:
+            current_app.logger.warning(f"[SINGLEFLIGHT] No se pudo publicar el resultado de {key}: {e}")
+        return value
+    finally:
+        try:
+            _release(keys=[lock_key], args=[token])
+        except RedisError:
+            pass
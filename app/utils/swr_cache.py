@@ -0,0 +1,84 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app.extensions import cache, redis_client
+
+# Stale-while-revalidate entries: the cached value carries its own soft expiry
+# while the backend key lives CACHE_STALE_TIMEOUT seconds longer. A read past
+# the soft expiry still returns the value and starts one refresh (per key, on
+# any worker) in the background instead of making the request wait on the API.
+REFRESH_LOCK_TTL = 30
+
+_refresh_pool = None
+
+
+def get_refresh_pool():
+    global _refresh_pool
+    if _refresh_pool is None:
+        _refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+    return _refresh_pool
+
+
+def wrap(value, timeout):
+    return {"value": value, "fresh_until": time.time() + timeout}
+
+
+def unwrap(entry):
+    # Returns (value, is_stale); entries written before this format are treated as stale.
+    if isinstance(entry, dict) and "fresh_until" in entry:
+        return entry["value"], entry["fresh_until"] <= time.time()
+    return entry, True
+
+
+def stale_timeout():
+    return current_app.config.get("CACHE_STALE_TIMEOUT", 86400)
+
+
+def swr_set(key, value, timeout=None, backend=None, stale=None):
+    # backend/stale let callbacks running outside an app context write entries.
+    timeout = timeout or current_app.config.get("CACHE_DEFAULT_TIMEOUT", 600)
+    stale = stale_timeout() if stale is None else stale
+    (backend or cache).set(key, wrap(value, timeout), timeout=timeout + stale)
+
+
+def refresh_in_background(key, loader, timeout=None):
+    # loader() runs in an app context; returning None (or raising) keeps the stale entry.
+    try:
+        if not redis_client.set(f"swr:refresh:{key}", 1, nx=True, ex=REFRESH_LOCK_TTL):
+            return
+    except RedisError:
+        return
+
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                value = loader()
+            except Exception as e:
+                app.logger.warning(f"[CACHE] No se pudo refrescar {key}; se sigue sirviendo la copia antigua: {e}")
+                return
+            if value is not None:
+                swr_set(key, value, timeout)
+
+    get_refresh_pool().submit(run)
+
+
+def swr_get(key, loader, timeout=None):
+    # Fresh hit: cached value. Stale hit: cached value plus a background refresh.
+    # Miss: loader() inline; its result is cached unless it is None, and any
+    # exception it raises reaches the caller.
+    entry = cache.get(key)
+    if entry is not None:
+        value, is_stale = unwrap(entry)
+        if is_stale:
+            refresh_in_background(key, loader, timeout)
+        return value
+
+    value = loader()
+    if value is not None:
+        swr_set(key, value, timeout)
+    return value
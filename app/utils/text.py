@@ -0,0 +1,34 @@
+import re
+import html
+import ftfy
+
+def normalize_categories(raw_categories):
+    flat = set()
+    for cat in raw_categories:
+        if not cat:
+            continue
+        parts = re.split(r"[\/,]", cat)
+        for part in parts:
+            cleaned = part.strip()
+            if cleaned:
+                flat.add(cleaned)
+    return list(flat)
+
+def clean_description(text):
+    if not text:
+        return ""
+    text = ftfy.fix_text(text)
+    text = html.unescape(text)
+    text = re.sub(r"<[^>]+>", " ", text)
+    text = re.sub(r"http\S+|www\.\S+", " ", text)
+    text = re.sub(r"[\n\r\t]+", " ", text)
+    text = re.sub(r"\s{2,}", " ", text)
+    return text.strip()
+
+def truncate(value, max_length):
+    return value[:max_length] if value and len(value) > max_length else value
+
+def force_https(url):
+    if url and url.startswith("http://"):
+        return url.replace("http://", "https://")
+    return url
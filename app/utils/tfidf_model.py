@@ -0,0 +1,105 @@
+import os
+import threading
+from datetime import datetime
+
+import joblib
+import numpy as np
+from scipy import sparse
+from flask import current_app
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+CURRENT_POINTER = "tfidf-current.txt"
+
+# Per worker process: (version, pointer mtime, vectorizer)
+_loaded = None
+_lock = threading.Lock()
+
+
+def model_dir():
+    return current_app.config.get("TFIDF_MODEL_DIR", "models")
+
+
+def artifact_path(version):
+    return os.path.join(model_dir(), f"tfidf-{version}.joblib")
+
+
+def fit_vectorizer(documents):
+    vectorizer = TfidfVectorizer(
+        dtype=np.float32,
+        max_features=current_app.config.get("TFIDF_MAX_FEATURES"),
+    )
+    vectorizer.fit(documents)
+    return vectorizer
+
+
+def save_vectorizer(vectorizer):
+    # Artifacts are written uncompressed so the idf array can be memory-mapped
+    # and shared by every gunicorn worker through the page cache.
+    os.makedirs(model_dir(), exist_ok=True)
+    version = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    path = artifact_path(version)
+    joblib.dump(vectorizer, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+    pointer = os.path.join(model_dir(), CURRENT_POINTER)
+    with open(pointer + ".tmp", "w") as fh:
+        fh.write(version)
+    os.replace(pointer + ".tmp", pointer)
+    return version, path
+
+
+def current_version():
+    pointer = os.path.join(model_dir(), CURRENT_POINTER)
+    try:
+        with open(pointer) as fh:
+            return fh.read().strip() or None, os.stat(pointer).st_mtime
+    except OSError:
+        return None, None
+
+
+# Returns (vectorizer, version), or (None, None) until the first `flask tfidf fit`.
+def get_shared_vectorizer():
+    global _loaded
+    version, mtime = current_version()
+    if not version:
+        return None, None
+
+    loaded = _loaded
+    if loaded and loaded[0] == version and loaded[1] == mtime:
+        return loaded[2], version
+
+    with _lock:
+        if _loaded and _loaded[0] == version and _loaded[1] == mtime:
+            return _loaded[2], version
+        try:
+            vectorizer = joblib.load(artifact_path(version), mmap_mode="r")
+        except (OSError, ValueError) as e:
+            current_app.logger.error(f"[TFIDF] No se pudo cargar el modelo {version}: {e}")
+            return None, None
+        _loaded = (version, mtime, vectorizer)
+        current_app.logger.info(f"[TFIDF] Modelo {version} cargado ({len(vectorizer.vocabulary_)} términos).")
+        return vectorizer, version
+
+
+# Single sparse rows are stored as int32 term indices followed by float32
+# weights, so candidate vectors can live in a BLOB column.
+def encode_vector(row):
+    row = row.tocsr()
+    return row.indices.astype(np.int32).tobytes() + row.data.astype(np.float32).tobytes()
+
+
+def decode_vectors(blobs, n_features):
+    indptr, indices, data = [0], [], []
+    for blob in blobs:
+        n = len(blob) // 8
+        indices.append(np.frombuffer(blob, dtype=np.int32, count=n))
+        data.append(np.frombuffer(blob, dtype=np.float32, count=n, offset=4 * n))
+        indptr.append(indptr[-1] + n)
+    return sparse.csr_matrix(
+        (
+            np.concatenate(data) if data else np.zeros(0, dtype=np.float32),
+            np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+            np.asarray(indptr),
+        ),
+        shape=(len(blobs), n_features),
+    )
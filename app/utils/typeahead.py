@@ -0,0 +1,212 @@
+import heapq
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from datetime import datetime
+
+from flask import current_app
+
+from app.extensions import db
+from app.models import Book, CandidateVolume, StoredVolume
+from app.utils.swr_cache import get_refresh_pool
+
+SUGGEST_LIMIT = 8
+SUGGEST_MIN_CHARS = 2
+# Prefixes up to this length can match most of the index, so their best
+# SUGGEST_LIMIT entries are ranked once per load; longer ones scan their range.
+TOP_PREFIX_CHARS = 3
+# Words after the first are indexed too ("marq" finds "García Márquez"),
+# except short ones like "de" or "la".
+MIN_WORD_CHARS = 3
+LOAD_BATCH = 5000
+
+# Per-worker prefix index: parallel sorted arrays of index keys (each term and
+# each of its later words onward) and (term, kind, text) entries, searched with
+# bisect. It is built in the background on the first request, then topped up
+# with the rows added since the last load every TYPEAHEAD_REFRESH_SECONDS;
+# requests never wait on a load.
+_index = None
+_next_refresh = 0.0
+_lock = threading.Lock()
+
+
+def normalize_term(text):
+    # Lowercase, accents stripped, whitespace collapsed: "García  Márquez" -> "garcia marquez".
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.lower().split())
+
+
+def index_keys(term):
+    # "garcia marquez" -> ["garcia marquez", "marquez"].
+    words = term.split(" ")
+    return [term] + [
+        " ".join(words[i:]) for i in range(1, len(words)) if len(words[i]) >= MIN_WORD_CHARS
+    ]
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.terms = []
+        self.entries = []
+        self.top = {}
+        self.weights = {}
+        # google_ids already counted: a volume weighs once however many tables
+        # hold it and however often it is refreshed or re-harvested.
+        self.counted = set()
+        # Terms whose weight moved in this load.
+        self.changed = set()
+        self.last_book_id = 0
+        self.last_harvested_at = datetime.min
+        self.last_fetched_at = datetime.min
+        self.loaded_at = 0.0
+
+    def add(self, text, kind, pending):
+        term = normalize_term(text)
+        if len(term) < SUGGEST_MIN_CHARS:
+            return
+        key = (term, kind)
+        if key not in self.weights and key not in pending:
+            pending[key] = text.strip()
+        self.weights[key] = self.weights.get(key, 0) + 1
+        self.changed.add(key)
+
+    def add_volume(self, google_id, title, authors, publisher, pending):
+        if google_id in self.counted:
+            return
+        self.counted.add(google_id)
+        self.add(title, "title", pending)
+        for author in authors or []:
+            self.add(author, "author", pending)
+        if publisher:
+            self.add(publisher, "publisher", pending)
+
+    def successor(self):
+        # A copy of the counters and high-water marks that the next load
+        # advances; the current index keeps serving requests until the swap.
+        nxt = PrefixIndex()
+        nxt.weights = dict(self.weights)
+        nxt.counted = set(self.counted)
+        nxt.last_book_id = self.last_book_id
+        nxt.last_harvested_at = self.last_harvested_at
+        nxt.last_fetched_at = self.last_fetched_at
+        return nxt
+
+    def rank(self, entries, limit=SUGGEST_LIMIT):
+        # Heaviest first, then shortest; one term can match through several keys.
+        return heapq.nsmallest(
+            limit, set(entries), key=lambda e: (-self.weights.get((e[0], e[1]), 1), len(e[2]), e[2])
+        )
+
+    def prefix_range(self, prefix):
+        start = bisect_left(self.terms, prefix)
+        return start, bisect_left(self.terms, prefix + "\uffff", start)
+
+    def merge(self, previous, pending):
+        rows = sorted(list(zip(previous.terms, previous.entries)) + [
+            (key, (term, kind, text)) for (term, kind), text in pending.items() for key in index_keys(term)
+        ])
+        self.terms = [key for key, _ in rows]
+        self.entries = [entry for _, entry in rows]
+
+        # Only the short prefixes of terms whose weight moved are re-ranked;
+        # on the first load that is all of them.
+        self.top = dict(previous.top)
+        prefixes = {
+            key[:n]
+            for term, _ in self.changed
+            for key in index_keys(term)
+            for n in range(SUGGEST_MIN_CHARS, min(len(key), TOP_PREFIX_CHARS) + 1)
+        }
+        for prefix in prefixes:
+            start, end = self.prefix_range(prefix)
+            self.top[prefix] = self.rank(self.entries[start:end])
+        self.loaded_at = time.time()
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        prefix = normalize_term(prefix)
+        if len(prefix) < SUGGEST_MIN_CHARS:
+            return []
+        if len(prefix) <= TOP_PREFIX_CHARS:
+            matches = self.top.get(prefix, [])[:limit]
+        else:
+            start, end = self.prefix_range(prefix)
+            matches = self.rank(self.entries[start:end], limit)
+        return [{"text": text, "kind": kind} for _, kind, text in matches]
+
+
+def load_new_terms(index):
+    # Collects the terms of rows added since the index was last loaded and
+    # advances its high-water marks. Only the columns the index needs are read.
+    pending = {}
+
+    books = db.session.query(Book.id, Book.google_id, Book.title, Book.authors, Book.publisher).filter(
+        Book.id > index.last_book_id
+    ).order_by(Book.id)
+    for book_id, google_id, title, authors, publisher in books.yield_per(LOAD_BATCH):
+        authors = [a.strip() for a in (authors or "").split(",") if a.strip()]
+        index.add_volume(google_id, title, authors, publisher, pending)
+        index.last_book_id = book_id
+
+    candidates = db.session.query(
+        CandidateVolume.google_id, CandidateVolume.title, CandidateVolume.authors,
+        CandidateVolume.publisher, CandidateVolume.harvested_at,
+    ).filter(CandidateVolume.harvested_at > index.last_harvested_at).order_by(CandidateVolume.harvested_at)
+    for google_id, title, authors, publisher, harvested_at in candidates.yield_per(LOAD_BATCH):
+        index.add_volume(google_id, title, authors, publisher, pending)
+        index.last_harvested_at = harvested_at
+
+    stored = db.session.query(
+        StoredVolume.google_id, StoredVolume.title, StoredVolume.payload["authors"],
+        StoredVolume.payload["publisher"], StoredVolume.fetched_at,
+    ).filter(
+        StoredVolume.found.is_(True), StoredVolume.fetched_at > index.last_fetched_at
+    ).order_by(StoredVolume.fetched_at)
+    for google_id, title, authors, publisher, fetched_at in stored.yield_per(LOAD_BATCH):
+        index.add_volume(google_id, title, authors, publisher, pending)
+        index.last_fetched_at = fetched_at
+    return pending
+
+
+def refresh_index():
+    global _index
+    if not _lock.acquire(blocking=False):
+        return
+    try:
+        base = _index or PrefixIndex()
+        nxt = base.successor()
+        pending = load_new_terms(nxt)
+        nxt.merge(base, pending)
+        _index = nxt
+        current_app.logger.info(
+            f"[TYPEAHEAD] Índice actualizado: {len(pending)} términos nuevos, {len(_index.terms)} en total."
+        )
+    except Exception as e:
+        current_app.logger.warning(f"[TYPEAHEAD] No se pudo actualizar el índice: {e}")
+    finally:
+        _lock.release()
+
+
+def get_index():
+    # Returns the current index (empty until the first load lands) and
+    # schedules a background load once it is old enough.
+    global _next_refresh
+    now = time.time()
+    if now >= _next_refresh and not _lock.locked():
+        # Claimed up front so concurrent requests (or a failed load) don't
+        # queue a refresh each.
+        _next_refresh = now + current_app.config.get("TYPEAHEAD_REFRESH_SECONDS", 60)
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                refresh_index()
+                db.session.remove()
+
+        get_refresh_pool().submit(run)
+    return _index or PrefixIndex()
+
+
+def suggest(prefix, limit=SUGGEST_LIMIT):
+    return get_index().suggest(prefix, limit)
@@ -0,0 +1,250 @@
+import json
+from dataclasses import fields
+from datetime import datetime, timedelta
+
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.extensions import db, cache
+from app.models import StoredVolume
+from app.utils.google_books import (
+    GoogleBooksError,
+    GoogleBooksUnavailable,
+    Volume,
+    get_volume,
+    volume_listeners,
+)
+from app.utils.jobs import job, enqueue
+from app.utils.swr_cache import wrap, stale_timeout
+from app.utils.text import clean_description, force_https, truncate
+
+STORE_BATCH = 500
+_VOLUME_FIELDS = {f.name for f in fields(Volume)}
+
+
+def detail_cache_key(google_id):
+    return f"book:{google_id}"
+
+
+def refresh_interval(found=True):
+    config = current_app.config
+    if found:
+        return timedelta(days=config.get("VOLUME_REFRESH_DAYS", 30))
+    return timedelta(hours=config.get("VOLUME_MISSING_HOURS", 24))
+
+
+def normalize_volume(volume):
+    payload = volume.to_dict()
+    payload["title"] = volume.title.strip()
+    payload["description"] = clean_description(volume.description)
+    payload["thumbnail"] = force_https(volume.thumbnail)
+    payload["small_thumbnail"] = force_https(volume.small_thumbnail)
+    return payload
+
+
+def to_volume(row):
+    if row is None or not row.found:
+        return None
+    return Volume(**{k: v for k, v in row.payload.items() if k in _VOLUME_FIELDS})
+
+
+def upsert_statement(update_columns):
+    # INSERT that overwrites update_columns of an existing row (same google_id)
+    # instead of failing: ON DUPLICATE KEY UPDATE on MySQL, ON CONFLICT on SQLite.
+    table = StoredVolume.__table__
+    if db.engine.dialect.name == "mysql":
+        stmt = mysql_insert(table)
+        return stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns})
+    stmt = sqlite_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=["google_id"], set_={c: stmt.excluded[c] for c in update_columns}
+    )
+
+
+def store_volumes(volumes, missing_ids=()):
+    # Bulk loader: inserts or updates one row per volume. missing_ids are
+    # volumes the API had no data for; they are remembered for
+    # VOLUME_MISSING_HOURS so they are not re-queried on every request.
+    # Writes are upserts in their own transaction, so a concurrent store of the
+    # same volume can't fail and the caller's session is neither committed nor
+    # rolled back.
+    now = datetime.utcnow()
+    found = {v.google_id: v for v in volumes if v is not None and v.google_id}
+    missing = {gid for gid in missing_ids if gid and gid not in found}
+    if not found and not missing:
+        return 0
+
+    rows, kept = [], []
+    for gid, volume in found.items():
+        rows.append({
+            "google_id": gid,
+            "payload": normalize_volume(volume),
+            "isbn": truncate(volume.isbn, 20),
+            "language": truncate(volume.language, 20),
+            "title": truncate(volume.title.strip(), 255),
+            "found": True,
+            "fetched_at": now,
+            "refresh_after": now + refresh_interval(True),
+        })
+
+    table = StoredVolume.__table__
+    with db.engine.begin() as conn:
+        if missing:
+            # Rows with a last good copy keep it; only their next refresh moves out.
+            good = {
+                gid for (gid,) in conn.execute(
+                    select(table.c.google_id).where(
+                        table.c.google_id.in_(list(missing)),
+                        table.c.found.is_(True),
+                        table.c.title.isnot(None),
+                    )
+                )
+            }
+            for gid in missing:
+                row = {"google_id": gid, "refresh_after": now + refresh_interval(False)}
+                if gid in good:
+                    kept.append(row)
+                else:
+                    rows.append(dict(row, payload={"google_id": gid}, found=False, fetched_at=now))
+        if rows:
+            conn.execute(
+                upsert_statement(["payload", "isbn", "language", "title", "found", "fetched_at", "refresh_after"]),
+                [dict({"isbn": None, "language": None, "title": None}, **row) for row in rows],
+            )
+        if kept:
+            conn.execute(
+                table.update().where(table.c.google_id == bindparam("gid")).values(refresh_after=bindparam("next")),
+                [{"gid": row["google_id"], "next": row["refresh_after"]} for row in kept],
+            )
+    return len(found) + len(missing)
+
+
+def get_stored_volume(google_id):
+    # DB first, then the API. A row past refresh_after is still served and
+    # re-fetched by the worker. Raises GoogleBooksError only on a DB miss.
+    row = db.session.get(StoredVolume, google_id)
+    if row is not None:
+        if row.refresh_after <= datetime.utcnow():
+            enqueue("volumes.refresh", google_ids=[google_id])
+        return to_volume(row)
+
+    # A found volume is stored by persist_volumes as get_volume publishes it.
+    volume = get_volume(google_id)
+    if volume is None:
+        store_volumes([], missing_ids=[google_id])
+    return volume
+
+
+@job("volumes.refresh")
+def refresh_volumes(google_ids=None, limit=200):
+    # Re-fetches the given volumes, or the `limit` most overdue ones. Stops
+    # early when the API is rate limited or the circuit is open.
+    if google_ids is None:
+        google_ids = [
+            gid for (gid,) in db.session.query(StoredVolume.google_id)
+            .filter(StoredVolume.refresh_after <= datetime.utcnow())
+            .order_by(StoredVolume.refresh_after)
+            .limit(limit)
+        ]
+
+    fetched, missing = [], []
+    for gid in google_ids:
+        try:
+            volume = get_volume(gid)
+        except GoogleBooksUnavailable as e:
+            current_app.logger.warning(f"[VOLUMES] Refresco interrumpido: {e}")
+            break
+        except GoogleBooksError:
+            continue
+        if volume is not None:
+            fetched.append(volume)
+        else:
+            missing.append(gid)
+
+    # get_volume already stored the fetched volumes and re-warmed their detail
+    # cache through volume_listeners; only the misses are left to record.
+    total = len(fetched) + store_volumes([], missing)
+    current_app.logger.info(f"[VOLUMES] {total} volúmenes refrescados ({len(missing)} sin datos).")
+    return total
+
+
+def warm_detail_cache(volumes):
+    # One pipelined write for the whole batch, in the same normalized form
+    # book_detail stores after a lookup of its own.
+    timeout = current_app.config.get("CACHE_DEFAULT_TIMEOUT", 600)
+    entries = {
+        detail_cache_key(v.google_id): wrap(Volume(**normalize_volume(v)).to_summary(), timeout)
+        for v in volumes if v is not None and v.google_id and v.title
+    }
+    if not entries:
+        return
+    try:
+        cache.set_many(entries, timeout=timeout + stale_timeout())
+    except RedisError as e:
+        current_app.logger.warning(f"[VOLUMES] No se pudo precargar la caché de detalle: {e}")
+
+
+def persist_volumes(volumes):
+    # The Redis detail cache expires within a day; the stored copy keeps a
+    # result (or a local-pool recommendation) servable without the API after that.
+    try:
+        store_volumes(volumes)
+    except SQLAlchemyError as e:
+        current_app.logger.warning(f"[VOLUMES] No se pudieron guardar los volúmenes: {e}")
+
+
+# Every search, subject and ISBN response is stored and pre-warms the detail
+# pages of the volumes it returned, so clicking a result never costs a second
+# API call, even after its cache entry expires.
+volume_listeners.append(persist_volumes)
+volume_listeners.append(warm_detail_cache)
+
+
+def warm_volume_cache(limit=None, batch_size=STORE_BATCH):
+    # Bulk warmer: copies stored volumes (most recently fetched first) into the
+    # Redis detail cache, e.g. right after a Redis restart.
+    query = StoredVolume.query.filter_by(found=True).order_by(StoredVolume.fetched_at.desc())
+    if limit:
+        query = query.limit(limit)
+
+    batch, total = [], 0
+    for row in query.yield_per(batch_size):
+        batch.append(to_volume(row))
+        if len(batch) >= batch_size:
+            warm_detail_cache(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        warm_detail_cache(batch)
+        total += len(batch)
+    return total
+
+
+def iter_volume_items(lines):
+    # Accepts JSON lines holding either single API volume items or whole API
+    # responses ({"items": [...]}), as saved from the Google Books API.
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        data = json.loads(line)
+        items = (data.get("items") or []) if "items" in data else [data]
+        for item in items:
+            if item.get("id") and item.get("volumeInfo"):
+                yield Volume.from_item(item)
+
+
+def load_volumes(lines, batch_size=STORE_BATCH):
+    batch, total = [], 0
+    for volume in iter_volume_items(lines):
+        batch.append(volume)
+        if len(batch) >= batch_size:
+            total += store_volumes(batch)
+            batch = []
+    if batch:
+        total += store_volumes(batch)
+    return total
@@ -0,0 +1,59 @@
+# Benchmark: compiled map_to_main_category vs. the previous substring scan,
+# over a dump of category strings as returned by Google Books.
+#
+#   python -m benchmarks.bench_category_mapper [repeats]
+
+import os
+import sys
+import time
+
+from app.utils.recommend_engine import CATEGORY_GROUPS, map_to_main_category
+from app.utils.books import normalize_categories
+
+DATA = os.path.join(os.path.dirname(__file__), "data", "google_books_categories.txt")
+
+
+def legacy_map_to_main_category(raw_category):
+    if not raw_category:
+        return "Other"
+    raw = raw_category.lower()
+    for main_cat, subcats in CATEGORY_GROUPS.items():
+        if any(sub.lower() in raw for sub in subcats):
+            return main_cat
+    return "Other"
+
+
+def load_categories():
+    with open(DATA, encoding="utf-8") as fh:
+        raw = [line.strip() for line in fh if line.strip()]
+    # Both the raw strings and their normalized parts are mapped in the app.
+    return raw + normalize_categories(raw)
+
+
+def run(fn, categories, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for cat in categories:
+            fn(cat)
+    return (time.perf_counter() - start) / (repeats * len(categories)) * 1e6
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    categories = load_categories()
+
+    mismatches = [c for c in categories if legacy_map_to_main_category(c) != map_to_main_category(c)]
+    print(f"categories={len(categories)} mismatches={len(mismatches)}")
+
+    legacy = run(legacy_map_to_main_category, categories, repeats)
+    map_to_main_category.cache_clear()
+    cold = run(map_to_main_category.__wrapped__, categories, repeats)
+    warm = run(map_to_main_category, categories, repeats)
+
+    print(f"substring scan : {legacy:7.2f} µs/call")
+    print(f"compiled regex : {cold:7.2f} µs/call ({legacy / cold:.1f}x)")
+    print(f"memoized       : {warm:7.2f} µs/call ({legacy / warm:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
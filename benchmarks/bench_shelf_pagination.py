@@ -0,0 +1,114 @@
+# Benchmark: one page of a large library, the previous way (load every
+# library_books row, lazy-load each book, filter/sort/slice in Python) vs.
+# shelf_page's single paginated query.
+#
+#   python -m benchmarks.bench_shelf_pagination [n_books] [repeats]
+#
+# Seeds an in-memory SQLite database unless BENCH_DATABASE_URL points elsewhere
+# (use a scratch database: the tables are created and filled).
+
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import insert
+
+from app.extensions import db
+from app.models import Book, LibraryBook, User, UserLibrary
+from app.utils.shelves import SHELF_PAGE_SIZE, shelf_page
+
+WORDS = (
+    "dragon magic kingdom quest sword wizard empire rebellion prophecy war love heart "
+    "secret murder detective crime city night shadow blood ghost house family history"
+).split()
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("BENCH_DATABASE_URL", "sqlite://")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def seed(n, rng):
+    db.create_all()
+    user = User(username="bench", email="bench@example.com", password_hash="x")
+    db.session.add(user)
+    db.session.flush()
+    library = UserLibrary(user_id=user.id)
+    db.session.add(library)
+    db.session.flush()
+
+    db.session.execute(insert(Book), [
+        {
+            "google_id": f"bench{i}",
+            "title": " ".join(rng.choice(WORDS) for _ in range(3)).title(),
+            "authors": f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}",
+            "language": "es",
+        }
+        for i in range(n)
+    ])
+    book_ids = [book_id for (book_id,) in db.session.query(Book.id)]
+    start = datetime(2024, 1, 1)
+    db.session.execute(insert(LibraryBook), [
+        {"library_id": library.id, "book_id": book_id, "added_at": start + timedelta(minutes=i)}
+        for i, book_id in enumerate(book_ids)
+    ])
+    db.session.commit()
+    return library.id
+
+
+def in_python(library_id, search, sort, page):
+    library = db.session.get(UserLibrary, library_id)
+    query = library.library_books
+    if search:
+        query = [
+            lb for lb in query
+            if search in (lb.book.title or "").lower()
+            or search in (lb.book.authors or "").lower()
+        ]
+    # Same tie-breaks as shelf_order, so both sides return the same pages.
+    if sort == "title_asc":
+        query = sorted(query, key=lambda lb: ((lb.book.title or "").lower(), lb.book.id))
+    else:
+        query = sorted(query, key=lambda lb: (lb.added_at, lb.book.id), reverse=True)
+    start = (page - 1) * SHELF_PAGE_SIZE
+    return [lb.book for lb in query[start:start + SHELF_PAGE_SIZE]], len(query)
+
+
+def in_sql(library_id, search, sort, page):
+    return shelf_page("library", library_id, search, sort, page)
+
+
+def timeit(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        db.session.expire_all()
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    app = make_app()
+    with app.app_context():
+        library_id = seed(n, random.Random(42))
+        print(f"books={n} page_size={SHELF_PAGE_SIZE}")
+        for search, sort, page in (("", "recent", 1), ("", "title_asc", 3), ("dragon", "recent", 1)):
+            t_py, (books_py, total_py) = timeit(lambda: in_python(library_id, search, sort, page), repeats)
+            t_sql, (books_sql, total_sql) = timeit(lambda: in_sql(library_id, search, sort, page), repeats)
+            same = total_py == total_sql and [b.google_id for b in books_py] == [b.google_id for b in books_sql]
+            label = f"search={search!r} sort={sort} page={page}"
+            print(f"{label:40} python {t_py * 1000:8.2f} ms   sql {t_sql * 1000:8.2f} ms"
+                  f"  ({t_py / t_sql:.1f}x, total={total_sql}, same_page={same})")
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,41 @@ class Config:
 
     # External APIs
     GOOGLE_BOOKS_API_KEY = os.getenv("GOOGLE_BOOKS_API_KEY")
+    GOOGLE_BOOKS_POOL_SIZE = int(os.getenv("GOOGLE_BOOKS_POOL_SIZE", 10))
+    GOOGLE_BOOKS_MAX_RETRIES = int(os.getenv("GOOGLE_BOOKS_MAX_RETRIES", 2))
+    GOOGLE_BOOKS_BACKOFF = float(os.getenv("GOOGLE_BOOKS_BACKOFF", 0.3))
+    GOOGLE_BOOKS_RATE_PER_SECOND = float(os.getenv("GOOGLE_BOOKS_RATE_PER_SECOND", 5))
+    GOOGLE_BOOKS_BURST = int(os.getenv("GOOGLE_BOOKS_BURST", 10))
+    GOOGLE_BOOKS_DAILY_QUOTA = int(os.getenv("GOOGLE_BOOKS_DAILY_QUOTA", 1000))
+    GOOGLE_BOOKS_MAX_QUEUE_WAIT = float(os.getenv("GOOGLE_BOOKS_MAX_QUEUE_WAIT", 0.5))
+    GOOGLE_BOOKS_BREAKER_THRESHOLD = int(os.getenv("GOOGLE_BOOKS_BREAKER_THRESHOLD", 5))
+    GOOGLE_BOOKS_BREAKER_WINDOW = int(os.getenv("GOOGLE_BOOKS_BREAKER_WINDOW", 30))
+    GOOGLE_BOOKS_BREAKER_COOLDOWN = int(os.getenv("GOOGLE_BOOKS_BREAKER_COOLDOWN", 30))
+    VOLUME_REFRESH_DAYS = int(os.getenv("VOLUME_REFRESH_DAYS", 30))
+    VOLUME_MISSING_HOURS = int(os.getenv("VOLUME_MISSING_HOURS", 24))
+    ISBN_NEGATIVE_TTL = int(os.getenv("ISBN_NEGATIVE_TTL", 3600))
+    SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 200))
+    TYPEAHEAD_REFRESH_SECONDS = int(os.getenv("TYPEAHEAD_REFRESH_SECONDS", 60))
+
+    # Library imports
+    IMPORT_UPLOAD_DIR = os.getenv("IMPORT_UPLOAD_DIR", "uploads")
+    IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", 4))
+    IMPORT_QUEUE_WAIT = float(os.getenv("IMPORT_QUEUE_WAIT", 30))
+    MAX_CONTENT_LENGTH = int(os.getenv("MAX_UPLOAD_MB", 10)) * 1024 * 1024
+
+    # Recommendations
+    RECOMMEND_FETCH_WORKERS = int(os.getenv("RECOMMEND_FETCH_WORKERS", 8))
+    RECOMMEND_FETCH_DEADLINE = float(os.getenv("RECOMMEND_FETCH_DEADLINE", 8))
+    SUBJECT_CACHE_TIMEOUT = int(os.getenv("SUBJECT_CACHE_TIMEOUT", 3600))
+    LOCAL_POOL_MIN_CANDIDATES = int(os.getenv("LOCAL_POOL_MIN_CANDIDATES", 100))
+    LOCAL_POOL_MAX_CANDIDATES = int(os.getenv("LOCAL_POOL_MAX_CANDIDATES", 5000))
+    HARVEST_PAGES_PER_SUBJECT = int(os.getenv("HARVEST_PAGES_PER_SUBJECT", 2))
+    HARVEST_REQUEST_DELAY = float(os.getenv("HARVEST_REQUEST_DELAY", 1.0))
+    HARVEST_MAX_INDEX = int(os.getenv("HARVEST_MAX_INDEX", 400))
+    HARVEST_REFRESH_DAYS = int(os.getenv("HARVEST_REFRESH_DAYS", 7))
+    HARVEST_INTERVAL_HOURS = float(os.getenv("HARVEST_INTERVAL_HOURS", 6))
+    TFIDF_MODEL_DIR = os.getenv("TFIDF_MODEL_DIR", "models")
+    TFIDF_MAX_FEATURES = int(os.getenv("TFIDF_MAX_FEATURES", 50000))
 
     # Redis
     REDIS_HOST = os.getenv("REDIS_HOST", "redis")
@@ -30,3 +65,6 @@ class Config:
     # Cache defaults
     CACHE_TYPE = "RedisCache"
     CACHE_DEFAULT_TIMEOUT = int(os.getenv("CACHE_DEFAULT_TIMEOUT", 600))
+    # Entries past their soft timeout are still served (and refreshed in the
+    # background) until the stale timeout expires them for good.
+    CACHE_STALE_TIMEOUT = int(os.getenv("CACHE_STALE_TIMEOUT", 86400))
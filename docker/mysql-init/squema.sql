@@ -26,7 +26,9 @@ CREATE TABLE IF NOT EXISTS books (
   small_thumbnail VARCHAR(512),
   publisher VARCHAR(255),
   published_date VARCHAR(20),
-  PRIMARY KEY (id)
+  PRIMARY KEY (id),
+  KEY ix_books_isbn (isbn),
+  FULLTEXT KEY ft_books_search (title, authors, publisher, categories)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 CREATE TABLE IF NOT EXISTS user_libraries (
@@ -48,6 +50,7 @@ CREATE TABLE IF NOT EXISTS library_books (
   book_id INT NOT NULL,
   added_at DATETIME DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (library_id, book_id),
+  KEY ix_library_books_library_added (library_id, added_at),
   CONSTRAINT fk_library_books_library FOREIGN KEY (library_id) REFERENCES user_libraries (id) ON DELETE CASCADE,
   CONSTRAINT fk_library_books_book FOREIGN KEY (book_id) REFERENCES books (id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -57,6 +60,110 @@ CREATE TABLE IF NOT EXISTS wishlist_books (
   book_id INT NOT NULL,
   added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (wishlist_id, book_id),
+  KEY ix_wishlist_books_wishlist_added (wishlist_id, added_at),
   CONSTRAINT fk_wishlist_books_wishlist FOREIGN KEY (wishlist_id) REFERENCES wishlists (id) ON DELETE CASCADE,
   CONSTRAINT fk_wishlist_books_book FOREIGN KEY (book_id) REFERENCES books (id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS authors (
+  id INT NOT NULL AUTO_INCREMENT,
+  name VARCHAR(255) NOT NULL,
+  name_key VARCHAR(255) COLLATE utf8mb4_bin NOT NULL,
+  PRIMARY KEY (id),
+  UNIQUE KEY uq_authors_name_key (name_key)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS book_authors (
+  book_id INT NOT NULL,
+  author_id INT NOT NULL,
+  PRIMARY KEY (book_id, author_id),
+  KEY ix_book_authors_author_id (author_id),
+  CONSTRAINT fk_book_authors_book FOREIGN KEY (book_id) REFERENCES books (id) ON DELETE CASCADE,
+  CONSTRAINT fk_book_authors_author FOREIGN KEY (author_id) REFERENCES authors (id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS categories (
+  id INT NOT NULL AUTO_INCREMENT,
+  name VARCHAR(255) NOT NULL,
+  name_key VARCHAR(255) COLLATE utf8mb4_bin NOT NULL,
+  main_category VARCHAR(100) NOT NULL,
+  PRIMARY KEY (id),
+  UNIQUE KEY uq_categories_name_key (name_key),
+  KEY ix_categories_main_category (main_category)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS book_categories (
+  book_id INT NOT NULL,
+  category_id INT NOT NULL,
+  PRIMARY KEY (book_id, category_id),
+  KEY ix_book_categories_category_id (category_id),
+  CONSTRAINT fk_book_categories_book FOREIGN KEY (book_id) REFERENCES books (id) ON DELETE CASCADE,
+  CONSTRAINT fk_book_categories_category FOREIGN KEY (category_id) REFERENCES categories (id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS book_neighbors (
+  book_id INT NOT NULL,
+  neighbor_id INT NOT NULL,
+  score FLOAT NOT NULL,
+  PRIMARY KEY (book_id, neighbor_id),
+  CONSTRAINT fk_book_neighbors_book FOREIGN KEY (book_id) REFERENCES books (id) ON DELETE CASCADE,
+  CONSTRAINT fk_book_neighbors_neighbor FOREIGN KEY (neighbor_id) REFERENCES books (id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS candidate_volumes (
+  google_id VARCHAR(50) NOT NULL,
+  language VARCHAR(20) NOT NULL,
+  title VARCHAR(255) NOT NULL,
+  authors JSON NOT NULL,
+  categories JSON,
+  publisher VARCHAR(255),
+  published_date VARCHAR(20),
+  thumbnail VARCHAR(512),
+  isbn VARCHAR(20),
+  description TEXT,
+  dedupe_key VARCHAR(255) NOT NULL,
+  document TEXT NOT NULL,
+  vector BLOB,
+  model_version VARCHAR(20),
+  harvested_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (google_id),
+  KEY ix_candidate_volumes_model_version (model_version),
+  KEY ix_candidate_volumes_harvested_at (harvested_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS candidate_categories (
+  main_category VARCHAR(100) NOT NULL,
+  google_id VARCHAR(50) NOT NULL,
+  PRIMARY KEY (main_category, google_id),
+  CONSTRAINT fk_candidate_categories_volume FOREIGN KEY (google_id) REFERENCES candidate_volumes (google_id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS harvest_state (
+  language VARCHAR(20) NOT NULL,
+  subject VARCHAR(100) NOT NULL,
+  next_index INT NOT NULL DEFAULT 0,
+  exhausted TINYINT(1) NOT NULL DEFAULT 0,
+  last_run_at DATETIME,
+  PRIMARY KEY (language, subject)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS volumes (
+  google_id VARCHAR(50) NOT NULL,
+  isbn VARCHAR(20),
+  language VARCHAR(20),
+  title VARCHAR(255),
+  payload JSON NOT NULL,
+  found TINYINT(1) NOT NULL DEFAULT 1,
+  fetched_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  refresh_after DATETIME NOT NULL,
+  PRIMARY KEY (google_id),
+  KEY ix_volumes_isbn (isbn),
+  KEY ix_volumes_refresh_after (refresh_after)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS isbn_lookups (
+  isbn VARCHAR(13) NOT NULL,
+  google_id VARCHAR(50),
+  checked_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (isbn)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;